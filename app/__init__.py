@@ -57,6 +57,12 @@ def create_app(config_name='development'):
     app.register_blueprint(designlanguage_bp)
     app.register_blueprint(transcription_bp)
 
+    # Pre-open provider connections so the first chat skips the TLS handshake
+    # (LLM_WARMUP=1 only, so scripts and tests never contact the providers)
+    if os.getenv('LLM_WARMUP') == '1':
+        from app.services.llm_service import llm_service
+        llm_service.warmup()
+
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
@@ -106,10 +106,8 @@ def list_documents():
     for doc_type in ['transcripts', 'books']:
         folder = os.path.join(UPLOAD_FOLDER, doc_type)
         if os.path.exists(folder):
-            documents[doc_type] = [
-                f for f in os.listdir(folder)
-                if os.path.isfile(os.path.join(folder, f))
-            ]
+            with os.scandir(folder) as it:
+                documents[doc_type] = [entry.name for entry in it if entry.is_file()]
 
     return jsonify(documents)
 
@@ -383,6 +381,10 @@ def update_model_names():
         Settings.set('grok_model', grok_model)
         Settings.set('perplexity_model', perplexity_model)
 
+        # Apply the new settings to the running LLM service
+        from app.services.llm_service import llm_service
+        llm_service.reload_settings()
+
         print(f"Model names updated at {datetime.now()}")
 
         return jsonify({
@@ -522,9 +524,11 @@ def summarize_file_stream():
 
                     full_prompt = summarize_prompt + file_content
 
+                    # Reuse recent summaries of the same document, e.g. when rerunning after a failed synthesis
                     summary_response = llm_service.generate_simple_response(
                         messages=[{"role": "user", "content": full_prompt}],
-                        model=model
+                        model=model,
+                        use_cache=True
                     )
 
                     summary_content = summary_response.get('content', '')
@@ -642,9 +646,11 @@ def summarize_file():
                 print(f"Generating summary with {model}...")
                 full_prompt = summarize_prompt + file_content
 
+                # Reuse recent summaries of the same document, e.g. when rerunning after a failed synthesis
                 summary_response = llm_service.generate_simple_response(
                     messages=[{"role": "user", "content": full_prompt}],
-                    model=model
+                    model=model,
+                    use_cache=True
                 )
 
                 summary_content = summary_response.get('content', '')
@@ -752,6 +758,10 @@ def update_context_mode():
 
         Settings.set('context_mode', mode)
 
+        # Apply the new settings to the running LLM service
+        from app.services.llm_service import llm_service
+        llm_service.reload_settings()
+
         print(f"Context mode updated to {mode} at {datetime.now()}")
 
         return jsonify({
@@ -1253,6 +1263,13 @@ def save_embedding_settings():
 
         print(f"Updated embedding settings: chunk_size={chunk_size}, chunk_overlap={chunk_overlap}, chunks_to_retrieve={chunks_to_retrieve}")
 
+        # Apply the new settings to the running embedding service
+        try:
+            from app.services.embedding_service import embedding_service
+            embedding_service.reload_settings()
+        except ImportError as import_error:
+            print(f"Embedding service unavailable, settings apply on next start: {import_error}")
+
         return jsonify({
             'success': True,
             'chunk_size': chunk_size,
@@ -1355,14 +1372,14 @@ def get_stats():
             # Get context usage
             context_chars = 0
             if os.path.exists(CONTEXT_FOLDER):
-                for filename in os.listdir(CONTEXT_FOLDER):
-                    filepath = os.path.join(CONTEXT_FOLDER, filename)
-                    if os.path.isfile(filepath):
-                        try:
-                            with open(filepath, 'r', encoding='utf-8') as f:
-                                context_chars += len(f.read())
-                        except:
-                            pass  # Skip files that can't be read
+                with os.scandir(CONTEXT_FOLDER) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            try:
+                                with open(entry.path, 'r', encoding='utf-8') as f:
+                                    context_chars += len(f.read())
+                            except:
+                                pass  # Skip files that can't be read
 
             stats['context_used'] = context_chars
             stats['context_max'] = 200000  # Claude's context window
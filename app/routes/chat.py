@@ -11,6 +11,15 @@ from datetime import datetime
 chat_bp = Blueprint('chat', __name__)
 
 
+def _content_event(chunk: str) -> str:
+    """Frame a streamed response chunk as an SSE event.
+
+    Byte-for-byte the same as json.dumps({'content': chunk, 'done': False}),
+    but only the chunk itself goes through the encoder.
+    """
+    return 'data: {"content": ' + json.dumps(chunk) + ', "done": false}\n\n'
+
+
 @chat_bp.route('/chat')
 @chat_bp.route('/chat/<hash_id>')
 @login_required
@@ -366,7 +375,7 @@ def stream_message():
             ChatThread.update_model(thread_id, current_model)
 
             # Get streaming response from LLM
-            full_response = ""
+            response_parts = []
             result = llm_service.generate_response(
                 messages=conversation,
                 context=context,
@@ -385,10 +394,11 @@ def stream_message():
 
                 # Stream the response
                 for chunk in stream:
-                    full_response += chunk
-                    yield f"data: {json.dumps({'content': chunk, 'done': False})}\n\n"
+                    response_parts.append(chunk)
+                    yield _content_event(chunk)
 
                 # Store complete AI response and get message ID
+                full_response = "".join(response_parts)
                 message_id = None
                 if full_response:
                     message_id = ChatMessage.create(thread_id, 'assistant', full_response)
@@ -414,10 +424,11 @@ def stream_message():
             else:
                 # Old format - just an iterator
                 for chunk in result:
-                    full_response += chunk
-                    yield f"data: {json.dumps({'content': chunk, 'done': False})}\n\n"
+                    response_parts.append(chunk)
+                    yield _content_event(chunk)
 
                 # Store complete AI response and get message ID
+                full_response = "".join(response_parts)
                 message_id = None
                 if full_response:
                     message_id = ChatMessage.create(thread_id, 'assistant', full_response)
@@ -1,7 +1,17 @@
 """Embedding service for document processing with ChromaDB."""
 import os
+import re
 import json
-from typing import List, Dict
+import time
+import random
+import mmap
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 import google.generativeai as genai
@@ -12,13 +22,41 @@ class EmbeddingService:
     """Service for document embeddings using ChromaDB."""
 
     CONTEXT_FOLDER = 'documents/context'
+    CONTEXT_CONFIG_FILE = 'data/context_config.json'
+    FILE_HASHES_FILE = 'data/context_hashes.json'
     CHROMA_DB_PATH = 'data/chromadb'
     COLLECTION_NAME = 'context_documents'
     CHUNK_SIZE = 512  # Characters per chunk
     CHUNK_OVERLAP = 128  # Overlap between chunks
+    BREAK_PATTERN = re.compile(r'[.\n]')  # Sentence boundaries used when chunking
+    READ_WORKERS = 8  # Threads used to read and chunk context files
+    READ_AHEAD = 8  # Files read ahead of the encoder before waiting for it to catch up
+    MMAP_THRESHOLD = 1024 * 1024  # Files at least this large are memory-mapped instead of read
+    EMBEDDING_MODEL = 'models/text-embedding-004'
+    EMBEDDING_BATCH_SIZE = 100  # Texts per Gemini embed_content request (API maximum)
+    EMBEDDING_BATCH_MAX_CHARS = 3 * 1024 * 1024  # Keeps each request well under the 4 MiB payload limit
+    EMBEDDING_MAX_WORKERS = 4  # Maximum concurrent Gemini embedding requests
+    EMBEDDING_MAX_RETRIES = 5  # Retries for rate-limited (429) requests
+    EMBEDDING_RETRY_BASE_DELAY = 0.5  # Seconds, doubled on each retry
+    ADD_BATCH_SIZE = 256  # Chunks per collection.add call
+    EMBEDDING_FLUSH_SIZE = 1024  # Pending chunks (across files) encoded and stored together
+    EMBEDDING_CACHE_PATH = 'data/emb_cache'
+    EMBEDDING_CACHE_MAX_MB = 256  # Oldest cache files are evicted beyond this size
+    ENCODE_CACHE_SIZE = 4096  # In-memory LRU entries for individual text embeddings
+    # Embeddings are L2-normalized, so inner product ranks identically to cosine
+    # without recomputing norms on every query
+    COLLECTION_METADATA = {
+        "description": "Context documents for AI chat",
+        "hnsw:space": "ip"
+    }
+    # HNSW index defaults (overridable via hnsw_* settings)
+    HNSW_M = 32
+    HNSW_CONSTRUCTION_EF = 200
+    HNSW_SEARCH_EF = 64
 
     def __init__(self):
         self.embeddings_initialized = False
+        self._init_lock = threading.Lock()  # Serializes first-use initialization across request threads
         self.provider = 'gemini'  # Only Gemini supported
         self.gemini_key = None  # Gemini API key
         self.client = None
@@ -27,6 +65,21 @@ class EmbeddingService:
         self.chunk_size = self.CHUNK_SIZE
         self.chunk_overlap = self.CHUNK_OVERLAP
         self.chunks_to_retrieve = 5
+        # HNSW index settings
+        self.hnsw_m = self.HNSW_M
+        self.hnsw_construction_ef = self.HNSW_CONSTRUCTION_EF
+        self.hnsw_search_ef = self.HNSW_SEARCH_EF
+        self.embedding_batch_size = self.EMBEDDING_BATCH_SIZE
+        self.embedding_dimensions = None  # None keeps the model's full output size
+        # Parsed context config, reused until the file's mtime or size changes
+        self._config_cache = (None, None)
+        # In-memory LRU of text embeddings keyed by SHA-256 of the text
+        self._encode_cache = OrderedDict()
+        self._encode_cache_lock = threading.Lock()
+        # Adaptive limit for concurrent Gemini embedding requests
+        self._embed_slots = threading.Condition()
+        self._embed_in_flight = 0
+        self._embed_concurrency = self.EMBEDDING_MAX_WORKERS
 
     def initialize(self):
         """Initialize embedding model and ChromaDB."""
@@ -34,17 +87,7 @@ class EmbeddingService:
             print("=== Initializing embedding service ===")
 
             # Load chunk settings from database
-            print("Loading chunk settings from database...")
-            try:
-                self.chunk_size = int(Settings.get('chunk_size', self.CHUNK_SIZE))
-                self.chunk_overlap = int(Settings.get('chunk_overlap', 200))
-                self.chunks_to_retrieve = int(Settings.get('chunks_to_retrieve', 5))
-                print(f"[OK] Loaded embedding settings: chunk_size={self.chunk_size}, chunk_overlap={self.chunk_overlap}, chunks_to_retrieve={self.chunks_to_retrieve}")
-            except Exception as db_error:
-                print(f"[WARNING] Error loading settings from database: {db_error}")
-                print("[INFO] Using default settings")
-                self.chunk_size = self.CHUNK_SIZE
-                self.chunk_overlap = self.CHUNK_OVERLAP
+            self._load_settings()
 
             # Load embedding provider from database (default to Gemini)
             self.provider = Settings.get('embedding_provider', 'gemini')
@@ -69,11 +112,10 @@ class EmbeddingService:
             # Get or create collection
             print("Getting or creating collection...")
             try:
-                self.collection = self.client.get_or_create_collection(
-                    name=self.COLLECTION_NAME,
-                    metadata={"description": "Context documents for AI chat"}
-                )
+                self.collection = self._open_collection()
                 print(f"[OK] Collection ready with {self.collection.count()} existing documents")
+                if not self._collection_matches():
+                    print("[WARNING] Collection was built with a different embedding provider, model, dimension or distance metric; reprocess embeddings to rebuild it")
             except Exception as collection_error:
                 print(f"[ERROR] Failed to create/get collection: {collection_error}")
                 raise Exception(f"Failed to create/get ChromaDB collection: {collection_error}")
@@ -89,6 +131,96 @@ class EmbeddingService:
             # Re-raise the exception so it can be caught by the caller
             raise
 
+    def _load_settings(self):
+        """Read chunk, retrieval and index settings from the database, falling back to class defaults."""
+        print("Loading chunk settings from database...")
+        try:
+            self.chunk_size = int(Settings.get('chunk_size', self.CHUNK_SIZE))
+            self.chunk_overlap = int(Settings.get('chunk_overlap', 200))
+            self.chunks_to_retrieve = int(Settings.get('chunks_to_retrieve', 5))
+            self.hnsw_m = int(Settings.get('hnsw_m', self.HNSW_M))
+            self.hnsw_construction_ef = int(Settings.get('hnsw_construction_ef', self.HNSW_CONSTRUCTION_EF))
+            self.hnsw_search_ef = int(Settings.get('hnsw_search_ef', self.HNSW_SEARCH_EF))
+            # Clamp to the Gemini per-request limit
+            self.embedding_batch_size = max(1, min(
+                int(Settings.get('embedding_batch_size', self.EMBEDDING_BATCH_SIZE)),
+                self.EMBEDDING_BATCH_SIZE
+            ))
+            # Optional reduced output size; smaller vectors cut transfer, storage and distance cost
+            self.embedding_dimensions = int(Settings.get('embedding_dimensions', 0)) or None
+            print(f"[OK] Loaded embedding settings: chunk_size={self.chunk_size}, chunk_overlap={self.chunk_overlap}, chunks_to_retrieve={self.chunks_to_retrieve}")
+            print(f"[OK] Loaded HNSW settings: M={self.hnsw_m}, construction_ef={self.hnsw_construction_ef}, search_ef={self.hnsw_search_ef}")
+            if self.embedding_dimensions:
+                print(f"[OK] Using reduced embedding dimensions: {self.embedding_dimensions}")
+        except Exception as db_error:
+            print(f"[WARNING] Error loading settings from database: {db_error}")
+            print("[INFO] Using default settings")
+            self.chunk_size = self.CHUNK_SIZE
+            self.chunk_overlap = self.CHUNK_OVERLAP
+            self.hnsw_m = self.HNSW_M
+            self.hnsw_construction_ef = self.HNSW_CONSTRUCTION_EF
+            self.hnsw_search_ef = self.HNSW_SEARCH_EF
+            self.embedding_batch_size = self.EMBEDDING_BATCH_SIZE
+            self.embedding_dimensions = None
+
+    def reload_settings(self):
+        """Re-read settings after an admin edit, without reconnecting to ChromaDB.
+
+        Chunk and retrieval changes apply to the next processing run or search.
+        """
+        with self._init_lock:
+            self._load_settings()
+
+    def _ensure_initialized(self) -> bool:
+        """Initialize the service once, even when several requests arrive concurrently."""
+        if self.embeddings_initialized:
+            return True
+        with self._init_lock:
+            if not self.embeddings_initialized:
+                self.initialize()
+        return self.embeddings_initialized
+
+    def _vector_space_metadata(self) -> Dict:
+        """Collection metadata that fixes the vector space; a change requires a rebuild."""
+        return {
+            "provider": self.provider,
+            "embedding_model": self.EMBEDDING_MODEL,
+            "embedding_dimensions": self.embedding_dimensions or 0,  # 0 = model default
+            "hnsw:space": self.COLLECTION_METADATA["hnsw:space"]
+        }
+
+    def _collection_metadata(self) -> Dict:
+        """Build collection metadata including vector space and HNSW index parameters."""
+        return {
+            **self.COLLECTION_METADATA,
+            **self._vector_space_metadata(),
+            "hnsw:M": self.hnsw_m,
+            "hnsw:construction_ef": self.hnsw_construction_ef,
+            "hnsw:search_ef": self.hnsw_search_ef,
+            "hnsw:num_threads": os.cpu_count() or 1
+        }
+
+    def _open_collection(self):
+        """Open the existing collection with its stored metadata, creating it if missing.
+
+        get_or_create_collection is avoided because chromadb 0.4.x/0.5.x overwrites the
+        stored metadata with the passed one, which would hide a vector space mismatch.
+        """
+        try:
+            return self.client.get_collection(name=self.COLLECTION_NAME)
+        except Exception:
+            return self.client.create_collection(
+                name=self.COLLECTION_NAME,
+                metadata=self._collection_metadata()
+            )
+
+    def _collection_matches(self) -> bool:
+        """Check that the current collection was built for the configured vector space."""
+        metadata = self.collection.metadata or {}
+        # Chroma defaults to L2 when no space was recorded
+        metadata = {"hnsw:space": "l2", **metadata}
+        return all(metadata.get(key) == value for key, value in self._vector_space_metadata().items())
+
     def _init_gemini(self):
         """Initialize Gemini embedding API."""
         print("Initializing Gemini embedding API...")
@@ -102,163 +234,571 @@ class EmbeddingService:
             print(f"[ERROR] Failed to initialize Gemini: {gemini_error}")
             raise Exception(f"Failed to initialize Gemini embedding API: {gemini_error}")
 
-    def encode(self, texts):
+    def encode(self, texts, is_query: bool = False):
         """Encode texts to embeddings using the configured provider.
 
         Args:
             texts: String or list of strings to encode
+            is_query: Whether the texts are search queries rather than documents
 
         Returns:
             numpy array or list of embeddings
         """
-        if not self.embeddings_initialized:
-            self.initialize()
+        self._ensure_initialized()
 
         # Handle single string input
         if isinstance(texts, str):
             texts = [texts]
-            single_input = True
-        else:
-            single_input = False
 
         try:
-            embeddings = self._gemini_encode(texts)
-
-            # Return single embedding if single input
-            if single_input:
-                return embeddings[0] if isinstance(embeddings, list) else embeddings
-            return embeddings
+            return self._encode_with_cache(texts, is_query)
 
         except Exception as e:
             print(f"[ERROR] Failed to encode texts: {e}")
             raise
 
-    def _gemini_encode(self, texts):
-        """Encode texts using Gemini API one at a time for consistent format."""
-        import numpy as np
-        import time
+    def _encode_with_cache(self, texts: List[str], is_query: bool = False):
+        """Encode texts, serving repeated texts from the in-memory LRU cache."""
+        if len(texts) == 1:
+            # Single query: return a (1, dim) view of the cached row instead of copying it
+            return self._encode_one(texts[0], is_query)[np.newaxis, :]
+
+        keys = [(is_query, self.embedding_dimensions, hashlib.sha256(text.encode('utf-8')).digest()) for text in texts]
+        results = [None] * len(texts)
+        missing = {}  # key -> indices of texts not found in the cache
+
+        with self._encode_cache_lock:
+            for idx, key in enumerate(keys):
+                cached = self._encode_cache.get(key)
+                if cached is not None:
+                    self._encode_cache.move_to_end(key)
+                    results[idx] = cached
+                else:
+                    missing.setdefault(key, []).append(idx)
+
+        if missing:
+            missing_keys = list(missing.keys())
+            new_embeddings = self._normalize(self._gemini_encode([texts[missing[key][0]] for key in missing_keys], is_query))
+            with self._encode_cache_lock:
+                for key, embedding in zip(missing_keys, new_embeddings):
+                    # Cached rows are shared between callers, so guard them against mutation
+                    embedding.flags.writeable = False
+                    for idx in missing[key]:
+                        results[idx] = embedding
+                    self._encode_cache[key] = embedding
+                    self._encode_cache.move_to_end(key)
+                while len(self._encode_cache) > self.ENCODE_CACHE_SIZE:
+                    self._encode_cache.popitem(last=False)
+
+        return np.stack(results) if results else np.empty((0, 0), dtype=np.float32)
+
+    def _encode_one(self, text: str, is_query: bool = False) -> np.ndarray:
+        """Encode a single text through the LRU cache, skipping the batch bookkeeping."""
+        key = (is_query, self.embedding_dimensions, hashlib.sha256(text.encode('utf-8')).digest())
+        with self._encode_cache_lock:
+            cached = self._encode_cache.get(key)
+            if cached is not None:
+                self._encode_cache.move_to_end(key)
+                return cached
+
+        task_type = "retrieval_query" if is_query else "retrieval_document"
+        embedding = self._normalize(self._gemini_embed_batch([text], 0, 1, task_type))[0]
+        embedding.flags.writeable = False
+        with self._encode_cache_lock:
+            self._encode_cache[key] = embedding
+            self._encode_cache.move_to_end(key)
+            while len(self._encode_cache) > self.ENCODE_CACHE_SIZE:
+                self._encode_cache.popitem(last=False)
+        return embedding
+
+    @staticmethod
+    def _normalize(embeddings):
+        """L2-normalize embedding rows so inner product equals cosine similarity."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    def _gemini_encode(self, texts, is_query: bool = False):
+        """Encode texts using the Gemini API in concurrently submitted batches of embedding_batch_size."""
+        task_type = "retrieval_query" if is_query else "retrieval_document"
+
+        batch_starts = self._batch_starts(texts)
+        batches = [
+            texts[start:end]
+            for start, end in zip(batch_starts, batch_starts[1:] + [len(texts)])
+        ]
+        results = [None] * len(batches)
+
+        if len(batches) == 1:
+            results[0] = self._gemini_embed_batch(batches[0], 0, len(texts), task_type)
+        elif batches:
+            with ThreadPoolExecutor(max_workers=self.EMBEDDING_MAX_WORKERS) as executor:
+                futures = {
+                    executor.submit(self._gemini_embed_batch, batch, batch_starts[idx], len(texts), task_type): idx
+                    for idx, batch in enumerate(batches)
+                }
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
 
-        all_embeddings = []
+        if len(results) == 1:
+            return results[0]
+        return np.concatenate(results) if results else np.empty((0, 0), dtype=np.float32)
 
+    def _batch_starts(self, texts: List[str]) -> List[int]:
+        """Return the start index of each request batch, capped by count and total characters."""
+        starts = []
+        batch_len = batch_chars = 0
         for idx, text in enumerate(texts):
+            if not starts or batch_len >= self.embedding_batch_size or batch_chars + len(text) > self.EMBEDDING_BATCH_MAX_CHARS:
+                starts.append(idx)
+                batch_len = batch_chars = 0
+            batch_len += 1
+            batch_chars += len(text)
+        return starts
+
+    @staticmethod
+    def _is_rate_limit_error(error: Exception) -> bool:
+        """Check whether an API error is a 429 / quota exhaustion response."""
+        return (
+            getattr(error, 'code', None) == 429
+            or type(error).__name__ == 'ResourceExhausted'
+            or '429' in str(error)
+        )
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Return the server-requested retry delay in seconds, if the error carries one."""
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        try:
+            return max(0.0, float(headers.get('Retry-After')))
+        except (TypeError, ValueError):
+            return None
+
+    def _acquire_embed_slot(self):
+        """Wait until the adaptive in-flight limit allows another embedding request."""
+        with self._embed_slots:
+            while self._embed_in_flight >= self._embed_concurrency:
+                self._embed_slots.wait()
+            self._embed_in_flight += 1
+
+    def _release_embed_slot(self, rate_limited: bool = False):
+        """Release an embedding request slot, adapting the concurrency limit.
+
+        Rate-limited requests halve the allowed concurrency; successful ones
+        restore it one step at a time.
+        """
+        with self._embed_slots:
+            self._embed_in_flight -= 1
+            if rate_limited:
+                self._embed_concurrency = max(1, self._embed_concurrency // 2)
+            elif self._embed_concurrency < self.EMBEDDING_MAX_WORKERS:
+                self._embed_concurrency += 1
+            self._embed_slots.notify_all()
+
+    def _gemini_embed_batch(self, batch: List[str], offset: int, total: int, task_type: str = "retrieval_document") -> np.ndarray:
+        """Embed a single batch of texts, retrying rate-limited requests with backoff.
+
+        Returns:
+            float32 array with one row per text
+        """
+        for attempt in range(self.EMBEDDING_MAX_RETRIES + 1):
+            self._acquire_embed_slot()
+            rate_limited = False
+            retry_individually = False
+            retry_delay = None
             try:
-                # Process one text at a time to ensure consistent response format
-                result = genai.embed_content(
-                    model="models/text-embedding-004",
-                    content=text,
-                    task_type="retrieval_document"
-                )
+                embed_kwargs = {
+                    'model': self.EMBEDDING_MODEL,
+                    'content': batch,
+                    'task_type': task_type
+                }
+                if self.embedding_dimensions:
+                    embed_kwargs['output_dimensionality'] = self.embedding_dimensions
+                result = genai.embed_content(**embed_kwargs)
+            except Exception as e:
+                rate_limited = self._is_rate_limit_error(e)
+                if rate_limited and attempt < self.EMBEDDING_MAX_RETRIES:
+                    retry_delay = self._retry_after(e)
+                    if retry_delay is None:
+                        retry_delay = self.EMBEDDING_RETRY_BASE_DELAY * (2 ** attempt) * (0.75 + 0.5 * random.random())
+                    print(f"[WARNING] Gemini rate limit hit for texts {offset + 1}-{offset + len(batch)}/{total}, retrying in {retry_delay:.1f}s")
+                elif rate_limited or len(batch) == 1:
+                    print(f"[ERROR] Gemini encoding failed for texts {offset + 1}-{offset + len(batch)}/{total}: {e}")
+                    raise
+                else:
+                    print(f"[WARNING] Gemini batch failed for texts {offset + 1}-{offset + len(batch)}/{total}, retrying individually: {e}")
+                    retry_individually = True
+            finally:
+                self._release_embed_slot(rate_limited)
+
+            if retry_delay is not None:
+                # Back off without holding a slot, so batches that are ready can use it
+                time.sleep(retry_delay)
+                continue
+
+            if retry_individually:
+                # Isolate the failing text instead of losing the whole batch
+                return np.concatenate([
+                    self._gemini_embed_batch([text], offset + idx, total, task_type)
+                    for idx, text in enumerate(batch)
+                ])
 
+            try:
                 # Gemini API returns a dict, check for 'embedding' key
                 if isinstance(result, dict) and 'embedding' in result:
-                    embedding_vector = result['embedding']
+                    embedding_vectors = result['embedding']
                 elif hasattr(result, 'embedding'):
                     # Alternative: result might be an object with embedding attribute
-                    embedding_vector = result.embedding
+                    embedding_vectors = result.embedding
                 else:
                     raise Exception(f"Unexpected Gemini response format: {type(result)}, keys: {result.keys() if isinstance(result, dict) else 'N/A'}")
 
-                # Ensure it's a simple list of floats
-                if isinstance(embedding_vector, list):
-                    all_embeddings.append(embedding_vector)
-                else:
-                    # Convert to list if numpy array or other type
-                    all_embeddings.append(list(embedding_vector))
+                # A list input yields one vector per text; guard against a flat single vector
+                if len(embedding_vectors) > 0 and not hasattr(embedding_vectors[0], '__len__'):
+                    embedding_vectors = [embedding_vectors]
+
+                if len(embedding_vectors) != len(batch):
+                    raise Exception(f"Gemini returned {len(embedding_vectors)} embeddings for {len(batch)} texts")
 
-                # Rate limiting - process 10 per second
-                if (idx + 1) % 10 == 0 and (idx + 1) < len(texts):
-                    time.sleep(0.1)
+                # Convert straight to float32 rows, without intermediate per-vector lists
+                return np.asarray(embedding_vectors, dtype=np.float32)
 
             except Exception as e:
-                print(f"[ERROR] Gemini encoding failed for text {idx + 1}/{len(texts)}: {e}")
+                print(f"[ERROR] Gemini encoding failed for texts {offset + 1}-{offset + len(batch)}/{total}: {e}")
                 raise
 
-        return np.array(all_embeddings)
+    @staticmethod
+    def _find_breaks(text: str) -> List[int]:
+        """Return the character offsets of every '.' and newline in text.
+
+        Uses a vectorized scan over the UTF-32 code points, so offsets match
+        Python string indices for non-ASCII text as well.
+        """
+        try:
+            codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        except UnicodeEncodeError:
+            # Lone surrogates can't be encoded; fall back to the compiled regex scan
+            return [match.start() for match in EmbeddingService.BREAK_PATTERN.finditer(text)]
 
-    def chunk_text(self, text: str, filename: str, category: str = 'background_info') -> List[Dict]:
+        return np.flatnonzero((codepoints == 0x2E) | (codepoints == 0x0A)).tolist()
+
+    def chunk_text(self, text: str, filename: str, category: str = 'background_info') -> Dict[str, List]:
         """Split text into overlapping chunks.
 
         Args:
             text: The text content to chunk
             filename: Name of the source file
             category: Category of the file (transcript, books, background_info)
+
+        Returns:
+            Dict of parallel 'ids', 'texts' and 'metadatas' lists, ready for collection.add
         """
-        chunks = []
         text_length = len(text)
+        chunk_size = self.chunk_size
+        min_break = chunk_size // 2
+
+        # Upper bound on the chunk count: every step advances by at least the
+        # shortest allowed chunk minus the overlap
+        min_step = max(1, min(chunk_size, min_break + 2) - self.chunk_overlap)
+        capacity = text_length // min_step + 1
+        ids = [None] * capacity
+        texts = [None] * capacity
+        metadatas = [None] * capacity
+
         start = 0
         chunk_id = 0
 
+        # Positions of all sentence boundaries ('.' or newline), found in one pass
+        breaks = self._find_breaks(text)
+
+        # Per-file metadata fields, copied into each chunk's metadata
+        base_metadata = {'filename': filename, 'category': category}
+
         while start < text_length:
-            end = start + self.chunk_size
-            chunk_text = text[start:end]
+            end = start + chunk_size
 
             # Try to break at sentence boundary if possible
             if end < text_length:
-                last_period = chunk_text.rfind('.')
-                last_newline = chunk_text.rfind('\n')
-                break_point = max(last_period, last_newline)
+                # Last boundary before the end of this window
+                idx = bisect_left(breaks, end) - 1
+                break_point = breaks[idx] - start if idx >= 0 else -1
 
-                if break_point > self.chunk_size // 2:
+                if break_point > min_break:
                     end = start + break_point + 1
-                    chunk_text = text[start:end]
 
-            chunks.append({
-                'id': f"{filename}_chunk_{chunk_id}",
-                'text': chunk_text.strip(),
-                'metadata': {
-                    'filename': filename,
-                    'category': category,
-                    'chunk_id': chunk_id,
-                    'start': start,
-                    'end': end
-                }
-            })
+            # Trim surrounding whitespace on the bounds so each chunk is sliced once,
+            # instead of slicing and then copying again in strip()
+            text_start, text_end = start, min(end, text_length)
+            while text_start < text_end and text[text_start].isspace():
+                text_start += 1
+            while text_end > text_start and text[text_end - 1].isspace():
+                text_end -= 1
+
+            ids[chunk_id] = f"{filename}_chunk_{chunk_id}"
+            texts[chunk_id] = text[text_start:text_end]
+            metadata = base_metadata.copy()
+            metadata['chunk_id'] = chunk_id
+            metadata['start'] = start
+            metadata['end'] = end
+            metadatas[chunk_id] = metadata
 
             chunk_id += 1
             start = end - self.chunk_overlap
 
-        return chunks
+        del ids[chunk_id:], texts[chunk_id:], metadatas[chunk_id:]
+        return {'ids': ids, 'texts': texts, 'metadatas': metadatas}
+
+    def _load_context_config(self) -> Dict:
+        """Load the context config, reusing the parsed copy while the file is unchanged."""
+        stat = os.stat(self.CONTEXT_CONFIG_FILE)
+        # Nanosecond mtime plus size catches rewrites within the same second
+        version = (stat.st_mtime_ns, stat.st_size)
+        config, cached_version = self._config_cache
+        if config is not None and cached_version == version:
+            return config
+
+        with open(self.CONTEXT_CONFIG_FILE, 'rb') as f:
+            config = json.loads(f.read())
+        self._config_cache = (config, version)
+        return config
+
+    def _list_context_files(self) -> Dict[str, str]:
+        """Map names of readable .txt/.md files in the context folder to their paths.
+
+        Uses a single scandir pass, so no per-file stat calls are needed.
+        """
+        with os.scandir(self.CONTEXT_FOLDER) as it:
+            return {
+                entry.name: entry.path
+                for entry in it
+                if entry.name.endswith(('.txt', '.md')) and entry.is_file()
+            }
+
+    def _read_and_chunk(self, filename: str, category: str, filepath: Optional[str]) -> Tuple[str, Optional[Dict[str, List]], Optional[str]]:
+        """Read a context file and split it into chunks.
+
+        Returns:
+            Tuple of (filename, chunks, cache_key), where chunks is None if the file
+            is missing or not a text file
+        """
+        if filepath is None:
+            return filename, None, None
+
+        content, content_hash = self._read_context_file(filepath)
+
+        return filename, self.chunk_text(content, filename, category), self._embedding_cache_key(content_hash)
+
+    def _read_context_file(self, filepath: str) -> Tuple[str, str]:
+        """Read a context file as UTF-8 text.
+
+        Large files are memory-mapped so the raw bytes are hashed and decoded straight
+        from the page cache rather than copied into an intermediate heap buffer.
+
+        Returns:
+            Tuple of (content, SHA-256 hex digest of the raw file bytes)
+        """
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size >= self.MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    content_hash = hashlib.sha256(mm).hexdigest()
+                    content = str(mm, 'utf-8')
+            else:
+                data = f.read()
+                content_hash = hashlib.sha256(data).hexdigest()
+                content = data.decode('utf-8')
+
+        # Match text-mode reads, which translate Windows and old Mac line endings
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+
+        return content, content_hash
+
+    def _read_and_chunk_all(self, file_categories: Dict[str, str]):
+        """Read and chunk files in a background pool, yielding (filename, category, chunks, cache_key) in input order.
+
+        At most READ_AHEAD files are read ahead of the consumer, so file I/O
+        overlaps with encoding without loading every file into memory at once.
+        """
+        available = self._list_context_files()
+        pending_files = iter(file_categories.items())
+        with ThreadPoolExecutor(max_workers=self.READ_WORKERS) as executor:
+            def submit_next():
+                item = next(pending_files, None)
+                if item is not None:
+                    filename, category = item
+                    filepath = available.get(filename)
+                    # Missing or non-text files are reported in order without taking a worker
+                    future = executor.submit(self._read_and_chunk, filename, category, filepath) if filepath else None
+                    in_flight.append((filename, category, future))
+
+            in_flight = deque()
+            for _ in range(self.READ_AHEAD):
+                submit_next()
+
+            while in_flight:
+                filename, category, future = in_flight.popleft()
+                filename, chunks, cache_key = future.result() if future else (filename, None, None)
+                submit_next()
+                yield filename, category, chunks, cache_key
+
+    def _embedding_cache_key(self, content_hash: str) -> str:
+        """Build the embedding cache key for a file's content hash and the current chunk settings."""
+        key_source = f"{self.EMBEDDING_MODEL}:normalized:{self.embedding_dimensions}:{self.chunk_size}:{self.chunk_overlap}:{content_hash}"
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def _load_cached_embeddings(self, cache_key: str):
+        """Load cached embeddings for a file, or return None on a cache miss."""
+        path = os.path.join(self.EMBEDDING_CACHE_PATH, f"{cache_key}.npy")
+        try:
+            embeddings = np.load(path).astype(np.float32)
+            # Touch the file so eviction drops the least recently used entries first
+            os.utime(path)
+            return embeddings
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[WARNING] Failed to read embedding cache {path}: {e}")
+            return None
+
+    def _save_cached_embeddings(self, cache_key: str, embeddings):
+        """Store embeddings for a file in the on-disk cache as float16."""
+        try:
+            os.makedirs(self.EMBEDDING_CACHE_PATH, exist_ok=True)
+            path = os.path.join(self.EMBEDDING_CACHE_PATH, f"{cache_key}.npy")
+            np.save(path, np.asarray(embeddings).astype(np.float16))
+            self._evict_embedding_cache()
+        except Exception as e:
+            print(f"[WARNING] Failed to write embedding cache: {e}")
+
+    def _evict_embedding_cache(self):
+        """Remove least recently used cache files until the cache fits within EMBEDDING_CACHE_MAX_MB."""
+        entries = []
+        total_size = 0
+        with os.scandir(self.EMBEDDING_CACHE_PATH) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.npy'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+
+        max_size = self.EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        if total_size <= max_size:
+            return
+
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+            if total_size <= max_size:
+                break
+
+    def _encode_cached(self, cache_key: str, chunk_texts: List[str]):
+        """Encode a file's chunks, reusing cached embeddings when the content is unchanged."""
+        embeddings = self._load_cached_embeddings(cache_key)
+        if embeddings is not None and len(embeddings) == len(chunk_texts):
+            return embeddings
+
+        embeddings = self.encode(chunk_texts)
+        self._save_cached_embeddings(cache_key, embeddings)
+        return embeddings
+
+    def _load_file_hashes(self) -> Dict:
+        """Load the per-file hash sidecar recorded by the last processing run."""
+        try:
+            with open(self.FILE_HASHES_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"[WARNING] Failed to read file hashes: {e}")
+            return {}
+
+    def _save_file_hashes(self, files: Dict):
+        """Persist per-file hashes so the next run can skip unchanged files."""
+        try:
+            os.makedirs(os.path.dirname(self.FILE_HASHES_FILE), exist_ok=True)
+            tmp_path = f"{self.FILE_HASHES_FILE}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'files': files}, f, indent=2)
+            os.replace(tmp_path, self.FILE_HASHES_FILE)
+        except Exception as e:
+            print(f"[WARNING] Failed to write file hashes: {e}")
+
+    def _prepare_collection(self) -> Tuple[Dict, bool]:
+        """Reuse the existing collection when possible, otherwise recreate it.
+
+        Returns:
+            Tuple of (previous file hashes, rebuilt), where previous file hashes is
+            empty when the collection was recreated
+        """
+        previous = self._load_file_hashes().get('files', {})
+
+        if previous:
+            try:
+                self.collection = self._open_collection()
+                # Keep existing embeddings unless provider, model, dimension or metric changed
+                if self.collection.count() > 0 and self._collection_matches():
+                    return previous, False
+            except Exception as e:
+                print(f"  [WARNING] Could not reuse existing collection: {e}")
+
+        try:
+            # Delete the entire collection to handle embedding dimension changes
+            self.client.delete_collection(self.COLLECTION_NAME)
+        except Exception:
+            pass  # Collection might not exist yet
+
+        self.collection = self.client.create_collection(
+            name=self.COLLECTION_NAME,
+            metadata=self._collection_metadata()
+        )
+        return {}, True
+
+    def _remove_file_chunks(self, filename: str):
+        """Delete all stored chunks that belong to a file."""
+        self.collection.delete(where={'filename': filename})
+
+    def _add_to_collection(self, ids: List[str], embeddings, texts: List[str], metadatas: List[Dict]):
+        """Add chunks to the collection in batches of ADD_BATCH_SIZE to bound peak memory."""
+        # Chroma accepts numpy arrays, but 0.4.22-0.5.x still call tolist() on them
+        # internally; converting one ADD_BATCH_SIZE slice at a time bounds that cost
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        for start in range(0, len(ids), self.ADD_BATCH_SIZE):
+            end = start + self.ADD_BATCH_SIZE
+            self.collection.add(
+                ids=ids[start:end],
+                embeddings=embeddings[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end]
+            )
 
     def process_context_files(self):
         """Process all context files and store their embeddings."""
         print("\n=== Starting context files processing ===")
 
-        if not self.embeddings_initialized:
-            self.initialize()
-
-        if not self.embeddings_initialized:
+        if not self._ensure_initialized():
             print("[ERROR] Failed to initialize embedding service")
             return False
 
         try:
-            # Clear existing documents and recreate collection to handle dimension changes
-            print("\n[1/4] Clearing existing embeddings...")
-            try:
-                # Delete the entire collection to handle embedding dimension changes
-                # (e.g., switching from 384-dim sentence-transformers to 768-dim Gemini)
-                self.client.delete_collection(self.COLLECTION_NAME)
-                print("  [OK] Deleted existing collection")
-
-                # Recreate collection
-                self.collection = self.client.create_collection(
-                    name=self.COLLECTION_NAME,
-                    metadata={"description": "Context documents for AI chat"}
-                )
+            # Reuse the existing collection unless the vector space changed
+            print("\n[1/4] Checking existing embeddings...")
+            previous_files, rebuilt = self._prepare_collection()
+            if rebuilt:
                 print("  [OK] Created new collection")
-            except Exception as delete_error:
-                # Collection might not exist yet, that's fine
-                print(f"  [INFO] No existing collection to delete (this is normal for first run)")
-                # Collection should already be created in initialize()
+            else:
+                print(f"  [OK] Reusing collection with {len(previous_files)} previously embedded files")
 
             # Load context config with new schema (vectorized_files with categories)
             print("\n[2/4] Loading configuration...")
-            config_file = 'data/context_config.json'
             vectorized_files = {}
-            if os.path.exists(config_file):
+            if os.path.exists(self.CONTEXT_CONFIG_FILE):
                 try:
-                    with open(config_file, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
-                        vectorized_files = config.get('vectorized_files', {})
+                    vectorized_files = self._load_context_config().get('vectorized_files', {})
                     total_files = sum(len(files) for files in vectorized_files.values())
                     print(f"  [OK] Loaded vectorized files config: {total_files} files across {len(vectorized_files)} categories")
                 except Exception as e:
@@ -269,56 +809,73 @@ class EmbeddingService:
                 return False
 
             # Build file-to-category mapping
-            file_categories = {}
-            for category, files in vectorized_files.items():
-                for filename in files:
-                    file_categories[filename] = category
+            file_categories = {
+                filename: category
+                for category, files in vectorized_files.items()
+                for filename in files
+            }
 
             print(f"  [OK] Found {len(file_categories)} files to process")
 
+            # Drop chunks of files that are no longer configured
+            for filename in previous_files:
+                if filename not in file_categories:
+                    self._remove_file_chunks(filename)
+                    print(f"  [OK] Removed embeddings for {filename}")
+
             total_chunks = 0
             processed_files = 0
+            current_files = {}  # filename -> hash entry recorded for the next run
 
-            # Process each context file in vectorized_files
+            # Read and chunk files in parallel, encoding and storing pending chunks in bounded flushes
             print("\n[3/4] Processing and chunking files...")
-            for filename, category in file_categories.items():
-                filepath = os.path.join(self.CONTEXT_FOLDER, filename)
-
-                if os.path.isfile(filepath) and filename.endswith(('.txt', '.md')):
-                    print(f"  Processing: {filename} (category: {category})")
-
-                    # Read file content
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-
-                    # Chunk the text with category metadata
-                    chunks = self.chunk_text(content, filename, category)
-                    print(f"    -> Created {len(chunks)} chunks")
-
-                    if chunks:
-                        # Generate embeddings for all chunks
-                        print(f"    -> Generating embeddings...")
-                        chunk_texts = [chunk['text'] for chunk in chunks]
-                        embeddings = self.encode(chunk_texts)
-
-                        # Prepare data for ChromaDB
-                        ids = [chunk['id'] for chunk in chunks]
-                        metadatas = [chunk['metadata'] for chunk in chunks]
-
-                        # Add to collection
-                        print(f"    -> Storing in database...")
-                        self.collection.add(
-                            ids=ids,
-                            embeddings=embeddings.tolist(),
-                            documents=chunk_texts,
-                            metadatas=metadatas
-                        )
-
-                        total_chunks += len(chunks)
-                        processed_files += 1
-                        print(f"    [OK] Added {len(chunks)} chunks from {filename}\n")
-                else:
+            pending = []  # (cache_key, chunks, cached embeddings or None) per file awaiting storage
+            pending_chunks = 0
+            for filename, category, chunks, cache_key in self._read_and_chunk_all(file_categories):
+                if chunks is None:
                     print(f"  [WARNING] File not found or invalid: {filename}")
+                    if filename in previous_files:
+                        self._remove_file_chunks(filename)
+                    continue
+
+                chunk_texts = chunks['texts']
+                entry = {'hash': cache_key, 'category': category, 'chunks': len(chunk_texts)}
+                current_files[filename] = entry
+
+                if previous_files.get(filename) == entry:
+                    # Unchanged since the last run, chunks are already stored
+                    print(f"  Unchanged: {filename} ({len(chunk_texts)} chunks)")
+                    if chunk_texts:
+                        total_chunks += len(chunk_texts)
+                        processed_files += 1
+                    continue
+
+                if not rebuilt:
+                    self._remove_file_chunks(filename)
+
+                print(f"  Processing: {filename} (category: {category})")
+                print(f"    -> Created {len(chunk_texts)} chunks")
+                if chunk_texts:
+                    cached = self._load_cached_embeddings(cache_key)
+                    if cached is not None and len(cached) != len(chunk_texts):
+                        cached = None
+                    if cached is not None:
+                        print(f"    -> Using cached embeddings")
+
+                    pending.append((cache_key, chunks, cached))
+                    pending_chunks += len(chunk_texts)
+                    total_chunks += len(chunk_texts)
+                    processed_files += 1
+
+                    if pending_chunks >= self.EMBEDDING_FLUSH_SIZE:
+                        self._flush_pending_files(pending)
+                        pending = []
+                        pending_chunks = 0
+
+            if pending:
+                self._flush_pending_files(pending)
+
+            self._save_file_hashes(current_files)
 
             print(f"\n[4/4] Finalizing...")
             print(f"  [OK] Successfully processed {processed_files} documents")
@@ -333,40 +890,56 @@ class EmbeddingService:
             print("=== Embedding processing failed ===\n")
             return False
 
+    def _flush_pending_files(self, pending: List[Tuple[str, Dict[str, List], Optional[np.ndarray]]]):
+        """Encode the uncached chunks of pending files in one call and store all of them.
+
+        Args:
+            pending: (cache_key, chunks, cached embeddings or None) per file
+        """
+        missing = [i for i, (_, _, cached) in enumerate(pending) if cached is None]
+        file_embeddings = [cached for _, _, cached in pending]
+        if missing:
+            missing_texts = [text for i in missing for text in pending[i][1]['texts']]
+            print(f"  -> Generating embeddings for {len(missing_texts)} chunks...")
+            new_embeddings = self.encode(missing_texts)
+
+            offset = 0
+            for i in missing:
+                cache_key, chunks, _ = pending[i]
+                count = len(chunks['texts'])
+                file_embeddings[i] = new_embeddings[offset:offset + count]
+                offset += count
+                self._save_cached_embeddings(cache_key, file_embeddings[i])
+
+        print(f"  -> Storing in database...")
+        self._add_to_collection(
+            [chunk_id for _, chunks, _ in pending for chunk_id in chunks['ids']],
+            np.concatenate(file_embeddings),
+            [text for _, chunks, _ in pending for text in chunks['texts']],
+            [metadata for _, chunks, _ in pending for metadata in chunks['metadatas']]
+        )
+
     def process_context_files_streaming(self):
         """Process all context files and yield progress updates for SSE streaming."""
         print("\n=== Starting context files processing (streaming) ===")
 
-        if not self.embeddings_initialized:
-            self.initialize()
-
-        if not self.embeddings_initialized:
+        if not self._ensure_initialized():
             yield {'type': 'error', 'message': 'Failed to initialize embedding service'}
             return
 
         try:
-            # Step 1: Clear existing
-            yield {'type': 'progress', 'step': 1, 'total_steps': 4, 'message': 'Clearing existing embeddings...'}
+            # Step 1: Reuse the existing collection unless the vector space changed
+            yield {'type': 'progress', 'step': 1, 'total_steps': 4, 'message': 'Checking existing embeddings...'}
 
-            try:
-                self.client.delete_collection(self.COLLECTION_NAME)
-                self.collection = self.client.create_collection(
-                    name=self.COLLECTION_NAME,
-                    metadata={"description": "Context documents for AI chat"}
-                )
-            except Exception:
-                pass  # Collection might not exist
+            previous_files, rebuilt = self._prepare_collection()
 
             # Step 2: Load config
             yield {'type': 'progress', 'step': 2, 'total_steps': 4, 'message': 'Loading configuration...'}
 
-            config_file = 'data/context_config.json'
             vectorized_files = {}
-            if os.path.exists(config_file):
+            if os.path.exists(self.CONTEXT_CONFIG_FILE):
                 try:
-                    with open(config_file, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
-                        vectorized_files = config.get('vectorized_files', {})
+                    vectorized_files = self._load_context_config().get('vectorized_files', {})
                 except Exception as e:
                     yield {'type': 'error', 'message': f'Error loading config: {e}'}
                     return
@@ -376,13 +949,20 @@ class EmbeddingService:
                 return
 
             # Build file-to-category mapping
-            file_categories = {}
-            for category, files in vectorized_files.items():
-                for filename in files:
-                    file_categories[filename] = category
+            file_categories = {
+                filename: category
+                for category, files in vectorized_files.items()
+                for filename in files
+            }
+
+            # Drop chunks of files that are no longer configured
+            for filename in previous_files:
+                if filename not in file_categories:
+                    self._remove_file_chunks(filename)
 
             total_files = len(file_categories)
             if total_files == 0:
+                self._save_file_hashes({})
                 yield {'type': 'complete', 'message': 'No files to process', 'document_count': 0, 'chunk_count': 0}
                 return
 
@@ -390,53 +970,61 @@ class EmbeddingService:
 
             total_chunks = 0
             processed_files = 0
+            current_files = {}  # filename -> hash entry recorded for the next run
+            pending = []  # (cache_key, chunks, embeddings) per file awaiting a collection write
+            pending_chunks = 0
+
+            # Step 3: Process each file (reading and chunking run ahead in a thread pool)
+            for filename, category, chunks, cache_key in self._read_and_chunk_all(file_categories):
+                if chunks is None:
+                    if filename in previous_files:
+                        self._remove_file_chunks(filename)
+                    continue
+
+                yield {
+                    'type': 'file_progress',
+                    'filename': filename,
+                    'current': processed_files + 1,
+                    'total': total_files,
+                    'message': f'Processing {filename}...'
+                }
 
-            # Step 3: Process each file
-            for filename, category in file_categories.items():
-                filepath = os.path.join(self.CONTEXT_FOLDER, filename)
-
-                if os.path.isfile(filepath) and filename.endswith(('.txt', '.md')):
-                    yield {
-                        'type': 'file_progress',
-                        'filename': filename,
-                        'current': processed_files + 1,
-                        'total': total_files,
-                        'message': f'Processing {filename}...'
-                    }
+                chunk_texts = chunks['texts']
+                entry = {'hash': cache_key, 'category': category, 'chunks': len(chunk_texts)}
+                current_files[filename] = entry
+                unchanged = previous_files.get(filename) == entry
 
-                    # Read file content
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
+                if not unchanged and not rebuilt:
+                    self._remove_file_chunks(filename)
 
-                    # Chunk the text
-                    chunks = self.chunk_text(content, filename, category)
+                if chunk_texts:
+                    if not unchanged:
+                        # Generate embeddings (reused from the cache for unchanged files)
+                        embeddings = self._encode_cached(cache_key, chunk_texts)
 
-                    if chunks:
-                        # Generate embeddings
-                        chunk_texts = [chunk['text'] for chunk in chunks]
-                        embeddings = self.encode(chunk_texts)
+                        # Buffer across files so the collection is written in large batches
+                        pending.append((cache_key, chunks, embeddings))
+                        pending_chunks += len(chunk_texts)
+                        if pending_chunks >= self.EMBEDDING_FLUSH_SIZE:
+                            self._flush_pending_files(pending)
+                            pending = []
+                            pending_chunks = 0
 
-                        # Prepare and add to collection
-                        ids = [chunk['id'] for chunk in chunks]
-                        metadatas = [chunk['metadata'] for chunk in chunks]
+                    total_chunks += len(chunk_texts)
+                    processed_files += 1
 
-                        self.collection.add(
-                            ids=ids,
-                            embeddings=embeddings.tolist(),
-                            documents=chunk_texts,
-                            metadatas=metadatas
-                        )
+                    yield {
+                        'type': 'file_complete',
+                        'filename': filename,
+                        'chunks': len(chunk_texts),
+                        'current': processed_files,
+                        'total': total_files
+                    }
 
-                        total_chunks += len(chunks)
-                        processed_files += 1
+            if pending:
+                self._flush_pending_files(pending)
 
-                        yield {
-                            'type': 'file_complete',
-                            'filename': filename,
-                            'chunks': len(chunks),
-                            'current': processed_files,
-                            'total': total_files
-                        }
+            self._save_file_hashes(current_files)
 
             # Step 4: Complete
             yield {'type': 'progress', 'step': 4, 'total_steps': 4, 'message': 'Finalizing...'}
@@ -456,67 +1044,73 @@ class EmbeddingService:
 
     def search_context(self, query: str, top_k: int = None) -> str:
         """Search for relevant context based on query using semantic search."""
-        if not self.embeddings_initialized:
-            self.initialize()
+        return self.search_context_batch([query], top_k)[0]
+
+    def search_context_batch(self, queries: List[str], top_k: int = None) -> List[str]:
+        """Search for relevant context for several queries with one encode and one query call.
 
-        if not self.embeddings_initialized or self.collection.count() == 0:
-            return ""
+        Args:
+            queries: Query strings to search for
+            top_k: Number of chunks per query (defaults to chunks_to_retrieve)
+
+        Returns:
+            List of context strings, one per query (empty string when nothing is found)
+        """
+        empty = [""] * len(queries)
+        if not queries:
+            return empty
+
+        if not self._ensure_initialized():
+            return empty
+
+        # One storage round-trip serves both the empty check and the result cap
+        collection_count = self.collection.count()
+        if collection_count == 0:
+            return empty
 
         # Use configured chunks_to_retrieve if top_k not specified
         if top_k is None:
             top_k = self.chunks_to_retrieve
 
         try:
-            # Generate query embedding
-            query_embedding = self.encode(query)
-
-            # Convert to proper format for ChromaDB
-            # Ensure it's a flat list, not nested
-            if hasattr(query_embedding, 'tolist'):
-                # NumPy array
-                embedding_list = query_embedding.tolist()
-            else:
-                # Already a list
-                embedding_list = query_embedding
+            # Generate all query embeddings in a single call
+            query_embeddings = self.encode(list(queries), is_query=True)
 
-            # Ensure we have a flat list (not nested)
-            if isinstance(embedding_list, list) and isinstance(embedding_list[0], list):
-                embedding_list = embedding_list[0]
-
-            # Search ChromaDB
+            # Search ChromaDB for all queries at once
             results = self.collection.query(
-                query_embeddings=[embedding_list],
-                n_results=min(top_k, self.collection.count())
+                query_embeddings=query_embeddings,
+                n_results=min(top_k, collection_count)
             )
 
-            # Format results as context string with clear source attribution
-            context_parts = []
-            if results['documents'] and len(results['documents']) > 0:
-                for i, doc in enumerate(results['documents'][0]):
-                    metadata = results['metadatas'][0][i]
-                    filename = metadata.get('filename', 'unknown')
-                    category = metadata.get('category', 'background_info')
-                    chunk_id = metadata.get('chunk_id', i)
+            # Format results as context strings with clear source attribution
+            contexts = []
+            documents = results['documents'] or []
+            for query_idx in range(len(queries)):
+                context_parts = []
+                if query_idx < len(documents):
+                    for i, doc in enumerate(documents[query_idx]):
+                        metadata = results['metadatas'][query_idx][i]
+                        filename = metadata.get('filename', 'unknown')
+                        category = metadata.get('category', 'background_info')
+                        chunk_id = metadata.get('chunk_id', i)
+
+                        # Format: --- Source: filename [category] (Chunk #X) ---
+                        source_header = f"--- Source: {filename} [{category}] (Chunk #{chunk_id + 1}) ---"
+                        context_parts.append(f"{source_header}\n{doc}\n")
 
-                    # Format: --- Source: filename [category] (Chunk #X) ---
-                    source_header = f"--- Source: {filename} [{category}] (Chunk #{chunk_id + 1}) ---"
-                    context_parts.append(f"{source_header}\n{doc}\n")
+                contexts.append("\n".join(context_parts) if context_parts else "")
 
-            return "\n".join(context_parts) if context_parts else ""
+            return contexts
 
         except Exception as e:
             print(f"Error searching context: {e}")
-            return ""
+            return empty
 
     def get_stats(self) -> Dict:
         """Get statistics about stored embeddings."""
         try:
-            # Initialize if not already initialized
-            if not self.embeddings_initialized:
-                self.initialize()
-
-            # If initialization failed, return zeros
-            if not self.embeddings_initialized:
+            # Initialize if not already initialized; if that failed, return zeros
+            if not self._ensure_initialized():
                 return {
                     'initialized': False,
                     'document_count': 0,
@@ -524,15 +1118,31 @@ class EmbeddingService:
                 }
 
             # Count unique documents
-            if self.collection.count() == 0:
+            chunk_count = self.collection.count()
+            if chunk_count == 0:
                 return {
                     'initialized': True,
                     'document_count': 0,
                     'chunk_count': 0
                 }
 
-            # Get all items to count unique files
-            items = self.collection.get()
+            # Collections from before normalization (L2 or no recorded metric) score on a
+            # different scale until reprocessing recreates them
+            needs_reprocess = not self._collection_matches()
+
+            # The hash sidecar already lists every stored file; trust it when its chunk
+            # total matches the collection, so no metadata has to be fetched
+            files = self._load_file_hashes().get('files', {})
+            if files and sum(entry.get('chunks', 0) for entry in files.values()) == chunk_count:
+                return {
+                    'initialized': True,
+                    'document_count': sum(1 for entry in files.values() if entry.get('chunks')),
+                    'chunk_count': chunk_count,
+                    'needs_reprocess': needs_reprocess
+                }
+
+            # Fetch only metadatas (no documents or embeddings) to count unique files
+            items = self.collection.get(include=['metadatas'])
             unique_files = set()
             if items['metadatas']:
                 for metadata in items['metadatas']:
@@ -542,7 +1152,8 @@ class EmbeddingService:
             return {
                 'initialized': True,
                 'document_count': len(unique_files),
-                'chunk_count': self.collection.count()
+                'chunk_count': chunk_count,
+                'needs_reprocess': needs_reprocess
             }
 
         except Exception as e:
@@ -1,10 +1,97 @@
 """LLM service for AI response generation."""
 import os
+import re
 import json
-import anthropic
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+import importlib.util
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 import httpx
 import google.generativeai as genai
-from typing import Iterator, Dict, Any
+from typing import Iterator, Dict, Optional
+
+
+class _SharedStream:
+    """Fans one upstream response stream out to any number of subscribers.
+
+    A background thread drains the upstream iterator into a buffer, so late
+    subscribers replay earlier chunks and a disconnecting client does not cut
+    the stream short for the others. Once every subscriber has gone away the
+    upstream call is closed, so an abandoned response is not generated in full.
+    """
+
+    def __init__(self, stream: Iterator[str], get_usage, on_done):
+        self._stream = stream
+        self.get_usage = get_usage
+        self._on_done = on_done
+        self._chunks = []
+        self._done = False
+        self._subscribers = 0
+        self._cancelled = False
+        self._cond = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self):
+        try:
+            for chunk in self._stream:
+                with self._cond:
+                    if self._cancelled:
+                        break
+                    self._chunks.append(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            print(f"Error in shared stream: {e}")
+            with self._cond:
+                self._chunks.append(f"\n\n[Error: {str(e)}]")
+        finally:
+            # Aborts the upstream request when the loop stopped early
+            self._stream.close()
+            self._on_done()
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def subscribe(self) -> Optional[Iterator[str]]:
+        """Yield every chunk of the stream from the start, or None if it was cancelled."""
+        with self._cond:
+            if self._cancelled:
+                return None
+            self._subscribers += 1
+        return self._replay()
+
+    def _replay(self) -> Iterator[str]:
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self._chunks) and not self._done:
+                        self._cond.wait()
+                    pending = self._chunks[index:]
+                    done = self._done
+                index += len(pending)
+                yield from pending
+                if done:
+                    return
+        finally:
+            self._unsubscribe()
+
+    def _unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+            if self._subscribers or self._done:
+                return
+            self._cancelled = True
+        # Evict right away so new identical requests start a fresh call
+        # instead of joining one that is being cancelled
+        self._on_done()
 
 
 class LLMService:
@@ -17,96 +104,437 @@ class LLMService:
 You have access to conference transcripts and related books.
 Respond concisely and insightfully, drawing from the provided context when relevant.
 Be professional, engaging, and help users derive meaningful insights."""
+    TRAILING_SPACE_PATTERN = re.compile(r'[ \t]+\n')
+    BLANK_LINES_PATTERN = re.compile(r'\n{3,}')
+    CONTEXT_READ_WORKERS = 8  # Threads used to read changed context files
+    RESPONSE_CACHE_SIZE = 256  # Non-streaming responses kept for use_cache requests
+    RESPONSE_CACHE_TTL = 3600  # Seconds
+    # Opt-in (LLM_CACHE=1) persistent response cache for development and evaluation runs
+    RESPONSE_CACHE_DB = 'data/llm_response_cache.db'
+    RESPONSE_CACHE_DB_SIZE = 10000  # Least recently used entries beyond this are evicted
+    # Providers report failures as response text; these are never cached
+    ERROR_RESPONSE_PREFIXES = ("Sorry, I encountered an error", "⚠️", "\n\n[Error:")
+    SETTINGS_CACHE_TTL = 5.0  # Seconds a database setting is reused before re-reading it
+    # Default max in-flight requests per provider, overridable with LLM_INFLIGHT_<PROVIDER>
+    PROVIDER_CONCURRENCY = {'claude': 8, 'gemini': 8, 'grok': 8, 'perplexity': 8}
+    PROVIDER_SLOT_TIMEOUT = 30.0  # Seconds to wait for a free slot before reporting the provider busy
+    DEFAULT_MAX_TOKENS = 2048  # Response length cap unless a caller asks for another
+    # Model used per provider when none is configured in the admin settings
+    DEFAULT_MODELS = {
+        'claude': 'claude-sonnet-4-5-20250929',
+        'gemini': 'gemini-2.5-flash-lite',
+        'grok': 'grok-4-fast-reasoning',
+        'perplexity': 'sonar'
+    }
+    # Chat roles -> Gemini roles (Gemini only knows 'user' and 'model')
+    GEMINI_ROLES = {'user': 'user', 'assistant': 'model', 'model': 'model', 'system': 'user'}
+    GROK_API_URL = "https://api.x.ai/v1/chat/completions"  # OpenAI-compatible format
+    GROK_MODELS_URL = "https://api.x.ai/v1/models"  # Cheap authenticated GET used by warmup()
+    PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+    # Provider -> (display name, endpoint, extra request options)
+    OPENAI_COMPATIBLE_APIS = {
+        'grok': ('Grok', GROK_API_URL, {'temperature': 0.7}),
+        'perplexity': ('Perplexity', PERPLEXITY_API_URL, {})
+    }
+    # The cached prefix (prompt + base context) is reused across conversation turns,
+    # which are often more than the default 5 minutes apart
+    CLAUDE_CACHE_CONTROL = {"type": "ephemeral", "ttl": "1h"}
+    HTTP_TIMEOUT = 120.0  # Seconds, for Grok and Perplexity requests
+    HTTP_CONNECT_TIMEOUT = 5.0  # Seconds to establish a connection before giving up
+    HTTP_MAX_CONNECTIONS = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+    HTTP_KEEPALIVE_EXPIRY = 300.0  # Seconds an idle pooled connection stays open
+    HTTP_MAX_RETRIES = 3  # Retries for rate-limited (429) and 5xx responses
+    HTTP_RETRY_BASE_DELAY = 0.5  # Seconds, doubled on each retry
+    HTTP_RETRY_MAX_DELAY = 8.0
+    HTTP_RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
 
     def __init__(self):
         self.anthropic_key = os.getenv('ANTHROPIC_API_KEY')
         self.gemini_key = os.getenv('GEMINI_API_KEY')
         self.grok_key = os.getenv('GROK_API_KEY')
         self.perplexity_key = os.getenv('PERPLEXITY_API_KEY')
+        self.debug_logging = self._debug_logging_enabled()
+
+        # Request headers only depend on the API keys, so build them once
+        self._http_headers = {
+            'grok': self._api_headers(self.grok_key),
+            'perplexity': self._api_headers(self.perplexity_key)
+        }
+
+        # Shared HTTP client so Grok and Perplexity requests reuse pooled keep-alive
+        # connections instead of paying a TCP + TLS handshake per call. HTTP/2 lets
+        # concurrent chats multiplex over one connection; it needs the optional h2 package.
+        self._http = httpx.Client(
+            http2=importlib.util.find_spec('h2') is not None,
+            timeout=httpx.Timeout(self.HTTP_TIMEOUT, connect=self.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=self.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=self.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=self.HTTP_KEEPALIVE_EXPIRY
+            )
+        )
+
+        # Per-provider cap on in-flight requests, so bursts queue locally
+        # instead of tripping upstream rate limits
+        self._provider_slots = {
+            provider: threading.BoundedSemaphore(int(os.getenv(f'LLM_INFLIGHT_{provider.upper()}', limit)))
+            for provider, limit in self.PROVIDER_CONCURRENCY.items()
+        }
+
+        # Database settings as key -> (value, expiry time), see _get_setting()
+        self._settings_cache = {}
+
+        # Provider name -> generate method, bound once
+        self._providers = {
+            'claude': self._generate_claude,
+            'gemini': self._generate_gemini,
+            'grok': self._generate_grok,
+            'perplexity': self._generate_perplexity
+        }
+
+        # Streaming requests currently in flight, keyed by a hash of their inputs
+        # (LLM_COALESCE=1 only; identical requests from different users share one answer)
+        self._coalesce_streams = os.getenv('LLM_COALESCE') == '1'
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+        # LRU of non-streaming responses: key -> (response text, expiry time)
+        self._response_cache = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+        # Disk-backed layer under it, shared across restarts (LLM_CACHE=1 only)
+        self._response_db = self._open_response_db() if os.getenv('LLM_CACHE') == '1' else None
+
+        # Cached file contents as (value, version) pairs, rebuilt when the files change
+        self._system_prompt_cache = (None, None)
+        self._context_config_cache = (None, None)
+        self._context_files_cache = (None, None)
+        self._context_file_cache = {}  # path -> (version, content) of each base context file
+        # System prompt + base context and its prebuilt cacheable Claude block
+        self._base_prompt_cache = (None, None, None)
+        self._base_prompt_fingerprint = (None, None)
+        self._claude_system_block = None
+
+        # One Claude client for the service lifetime, so requests reuse its pooled
+        # connections instead of opening a new one each time. Created on first use,
+        # so the SDK is only imported when Claude is actually called.
+        self._anthropic = None
+        self._anthropic_lock = threading.Lock()
+        # Last Gemini model as (model, (model name, system prompt))
+        self._gemini_model_cache = (None, None)
 
         # Configure Gemini if key is available
         if self.gemini_key:
             genai.configure(api_key=self.gemini_key)
 
+    @staticmethod
+    def _api_headers(api_key: Optional[str]) -> Dict[str, str]:
+        """Build the bearer-auth JSON headers for an OpenAI-compatible API."""
+        return {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def warmup(self):
+        """Open a pooled connection to Grok in the background.
+
+        Listing the models completes the TCP + TLS handshake up front, so the
+        first chat request does not pay for it. Perplexity has no equivalent
+        cheap GET endpoint, so its connection is opened by the first request.
+        """
+        if not self.grok_key:
+            return
+
+        def warm():
+            try:
+                self._http.get(self.GROK_MODELS_URL, headers=self._api_headers(self.grok_key))
+            except Exception as e:
+                print(f"Connection warmup failed for {self.GROK_MODELS_URL}: {e}")
+
+        threading.Thread(target=warm, daemon=True).start()
+
+    def _retry_delay(self, response: httpx.Response, attempt: int) -> float:
+        """Seconds to wait before retrying a rejected request.
+
+        Honours a numeric Retry-After header, otherwise uses exponential backoff
+        with jitter.
+        """
+        try:
+            delay = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            delay = self.HTTP_RETRY_BASE_DELAY * (2 ** attempt) * (0.75 + 0.5 * random.random())
+        return min(max(0.0, delay), self.HTTP_RETRY_MAX_DELAY)
+
+    @contextmanager
+    def _stream_request(self, provider: str, url: str, headers: dict, data: dict):
+        """Open a streaming POST, retrying 429 and 5xx responses with backoff before any content is read."""
+        for attempt in range(self.HTTP_MAX_RETRIES + 1):
+            with self._http.stream("POST", url, headers=headers, json=data) as response:
+                if response.status_code not in self.HTTP_RETRY_STATUS_CODES or attempt == self.HTTP_MAX_RETRIES:
+                    yield response
+                    return
+                delay = self._retry_delay(response, attempt)
+            print(f"[WARNING] {provider} returned HTTP {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _post_request(self, provider: str, url: str, headers: dict, data: dict) -> httpx.Response:
+        """POST a request, retrying 429 and 5xx responses with backoff."""
+        for attempt in range(self.HTTP_MAX_RETRIES + 1):
+            response = self._http.post(url, headers=headers, json=data)
+            if response.status_code not in self.HTTP_RETRY_STATUS_CODES or attempt == self.HTTP_MAX_RETRIES:
+                return response
+            delay = self._retry_delay(response, attempt)
+            print(f"[WARNING] {provider} returned HTTP {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _get_setting(self, key: str, default=None):
+        """Read a database setting, reusing the value for SETTINGS_CACHE_TTL seconds.
+
+        Model names and modes are read on every chat turn but only change from
+        the admin panel, which calls reload_settings() after saving them.
+        """
+        now = time.monotonic()
+        value, expires_at = self._settings_cache.get(key, (None, 0.0))
+        if expires_at <= now:
+            from app.models import Settings
+            value = Settings.get(key)
+            self._settings_cache[key] = (value, now + self.SETTINGS_CACHE_TTL)
+        return default if value is None else value
+
+    def reload_settings(self):
+        """Drop cached database settings so the next request reads the current values."""
+        self._settings_cache = {}
+        self.debug_logging = self._debug_logging_enabled()
+
+    @staticmethod
+    def _debug_logging_enabled() -> bool:
+        """Step-by-step request tracing (LLM_DEBUG); errors, warnings and usage are always printed."""
+        return os.getenv('LLM_DEBUG', '').lower() in ('1', 'true')
+
     def _get_provider(self) -> str:
         """Get current provider from database settings."""
         try:
-            from app.models import Settings
-            return Settings.get('llm_provider', os.getenv('LLM_PROVIDER', 'gemini')).lower()
+            return self._get_setting('llm_provider', os.getenv('LLM_PROVIDER', 'gemini')).lower()
         except Exception as e:
             print(f"Error reading provider from database: {e}")
             return os.getenv('LLM_PROVIDER', 'gemini').lower()
 
+    @staticmethod
+    def _file_version(path: str):
+        """Return (mtime_ns, size) identifying the current contents of a file, or None if it is missing."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
     def _load_system_prompt(self) -> str:
-        """Load system prompt from file or return default."""
+        """Load system prompt from file or return default.
+
+        The file is only re-read when its mtime or size changes.
+        """
         try:
-            if os.path.exists(self.SYSTEM_PROMPT_FILE):
+            version = self._file_version(self.SYSTEM_PROMPT_FILE)
+            if version is not None:
+                prompt, cached_version = self._system_prompt_cache
+                if prompt is not None and cached_version == version:
+                    return prompt
                 with open(self.SYSTEM_PROMPT_FILE, 'r', encoding='utf-8') as f:
-                    return f.read()
+                    prompt = f.read()
+                self._system_prompt_cache = (prompt, version)
+                return prompt
         except Exception as e:
             print(f"Error loading system prompt: {e}")
 
         return self.DEFAULT_SYSTEM_PROMPT
 
+    def _load_context_config(self) -> Dict:
+        """Load the context config, reusing the parsed copy while the file is unchanged."""
+        version = self._file_version(self.CONTEXT_CONFIG_FILE)
+        if version is None:
+            return {}
+
+        config, cached_version = self._context_config_cache
+        if config is not None and cached_version == version:
+            return config
+
+        try:
+            with open(self.CONTEXT_CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except Exception as e:
+            print(f"Error loading context config: {e}")
+            return {}
+        self._context_config_cache = (config, version)
+        return config
+
+    @classmethod
+    def _read_context_file(cls, filepath: str) -> Optional[str]:
+        """Read a context file, returning None if it is missing or unreadable.
+
+        Trailing spaces and runs of blank lines are squeezed out, since they
+        cost prompt tokens on every request without carrying any content.
+        """
+        if not os.path.isfile(filepath):
+            return None
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                content = f.read()
+            content = cls.TRAILING_SPACE_PATTERN.sub('\n', content)
+            return cls.BLANK_LINES_PATTERN.sub('\n\n', content).strip()
+        except Exception as e:
+            print(f"Error reading context file {os.path.basename(filepath)}: {e}")
+            return None
+
     def get_context_files(self) -> str:
         """Load base context files and active streaming files.
 
         New schema reads from:
         - base_context: array of filenames always included
         - streaming_sessions: dict of active streaming files (also always included)
+
+        The joined result is cached and only rebuilt when the config or one of
+        the listed files changes, so unchanged requests cost one stat per file.
         """
         try:
             if not os.path.exists(self.CONTEXT_FOLDER):
                 return ""
 
             # Load configuration
-            config = {}
-            if os.path.exists(self.CONTEXT_CONFIG_FILE):
-                try:
-                    with open(self.CONTEXT_CONFIG_FILE, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
-                except Exception as e:
-                    print(f"Error loading context config: {e}")
-
-            context_parts = []
-
-            # Load base context files
-            base_context = config.get('base_context', [])
-            for filename in base_context:
-                filepath = os.path.join(self.CONTEXT_FOLDER, filename)
-                if os.path.isfile(filepath):
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            context_parts.append(f"--- {filename} ---\n{content}\n")
-                    except Exception as e:
-                        print(f"Error reading base context file {filename}: {e}")
+            config = self._load_context_config()
+
+            # (filename, label) for base context files, then active streaming files
+            # (always in base context). A file listed more than once is included once.
+            base_files = dict.fromkeys(config.get('base_context', []))
+            entries = [(filename, filename) for filename in base_files]
+            entries.extend(
+                (filename, f"{filename} (LIVE)")
+                for filename in config.get('streaming_sessions', {}).keys()
+                if filename not in base_files
+            )
+
+            paths = [os.path.join(self.CONTEXT_FOLDER, filename) for filename, _ in entries]
+            versions = [self._file_version(filepath) for filepath in paths]
+            cache_key = tuple(zip((filename for filename, _ in entries), versions))
+            context, cached_key = self._context_files_cache
+            if context is not None and cached_key == cache_key:
+                return context
+
+            # Reuse unchanged files (a live streaming transcript typically changes
+            # while base files do not) and only read the rest
+            file_cache = self._context_file_cache
+            contents = [
+                content if version is not None and cached_version == version else None
+                for version, (cached_version, content) in zip(
+                    versions, (file_cache.get(filepath, (None, None)) for filepath in paths)
+                )
+            ]
+            stale = [i for i, content in enumerate(contents) if content is None and versions[i] is not None]
 
-            # Load active streaming files (always in base context)
-            streaming_sessions = config.get('streaming_sessions', {})
-            for filename in streaming_sessions.keys():
-                filepath = os.path.join(self.CONTEXT_FOLDER, filename)
-                if os.path.isfile(filepath):
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            context_parts.append(f"--- {filename} (LIVE) ---\n{content}\n")
-                    except Exception as e:
-                        print(f"Error reading streaming file {filename}: {e}")
+            # Read the stale files concurrently; the pool preserves their order
+            if len(stale) > 1:
+                with ThreadPoolExecutor(max_workers=min(len(stale), self.CONTEXT_READ_WORKERS)) as executor:
+                    fresh = list(executor.map(self._read_context_file, [paths[i] for i in stale]))
+            else:
+                fresh = [self._read_context_file(paths[i]) for i in stale]
+            for i, content in zip(stale, fresh):
+                contents[i] = content
+
+            self._context_file_cache = {
+                filepath: (version, content)
+                for filepath, version, content in zip(paths, versions, contents)
+                if content is not None
+            }
 
-            if context_parts:
-                return "\n".join(context_parts)
+            # Join header and body pieces in one pass, so large file bodies are
+            # copied once instead of first into a per-file string
+            pieces = []
+            for (_, label), content in zip(entries, contents):
+                if content is not None:
+                    pieces += ("--- ", label, " ---\n", content, "\n\n")
+            if pieces:
+                pieces[-1] = "\n"
+            context = "".join(pieces)
+            self._context_files_cache = (context, cache_key)
+            return context
 
         except Exception as e:
             print(f"Error loading context files: {e}")
 
         return ""
 
+    @staticmethod
+    def _fingerprint(text: str) -> str:
+        """Short content hash used in place of a large prompt inside request keys."""
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _get_prompt_fingerprint(self, base_prompt: str) -> str:
+        """Fingerprint of a base prompt, computed once per rebuild of the prompt."""
+        fingerprint, cached_prompt = self._base_prompt_fingerprint
+        if cached_prompt is base_prompt:
+            return fingerprint
+        return self._fingerprint(base_prompt)
+
+    def _get_base_prompt(self) -> str:
+        """Build the system prompt plus base context, reusing it while both inputs are unchanged.
+
+        Keeping this prefix byte-identical across requests is what lets Claude's
+        prompt cache hit.
+        """
+        system_prompt = self._load_system_prompt()
+        context_files = self.get_context_files()
+
+        base_prompt, cached_prompt, cached_context = self._base_prompt_cache
+        # The loaders return the same cached string objects until their files change
+        if base_prompt is not None and cached_prompt is system_prompt and cached_context is context_files:
+            return base_prompt
+
+        base_prompt = system_prompt
+        if context_files:
+            base_prompt += f"\n\nBase context:\n{context_files}"
+        self._base_prompt_cache = (base_prompt, system_prompt, context_files)
+        self._base_prompt_fingerprint = (self._fingerprint(base_prompt), base_prompt)
+        self._claude_system_block = {
+            "type": "text",
+            "text": base_prompt,
+            "cache_control": self.CLAUDE_CACHE_CONTROL
+        }
+        return base_prompt
+
+    @staticmethod
+    def _iter_sse_batches(response) -> Iterator[list]:
+        """Yield the server-sent event 'data:' payloads of each network read as a list, stopping at [DONE].
+
+        Splits the raw byte stream directly, so lines are never decoded to str;
+        json.loads accepts the UTF-8 payloads as they are. Events that arrive
+        together are returned together, so callers can relay them as one chunk.
+        """
+        buffer = bytearray()
+        batch = []
+        # A trailing newline flushes a final line that arrived without one
+        for part in chain(response.iter_bytes(), (b"\n",)):
+            # Only the new bytes can hold the next newline
+            scan = len(buffer)
+            buffer += part
+            start = 0
+            while (end := buffer.find(b"\n", scan)) != -1:
+                if buffer.startswith(b"data:", start, end):
+                    payload = bytes(buffer[start + 5:end].strip())
+                    if payload == b"[DONE]":
+                        if batch:
+                            yield batch
+                        return
+                    if payload:
+                        batch.append(payload)
+                start = scan = end + 1
+            del buffer[:start]
+            if batch:
+                yield batch
+                batch = []
+
     def _get_context_mode(self) -> str:
         """Get current context mode from database settings."""
         try:
-            from app.models import Settings
-            return Settings.get('context_mode', 'context_window').lower()
+            return self._get_setting('context_mode', 'context_window').lower()
         except Exception as e:
             print(f"Error reading context mode from database: {e}")
             return 'context_window'
@@ -114,23 +542,11 @@ Be professional, engaging, and help users derive meaningful insights."""
     def _get_model_name(self, provider: str) -> str:
         """Get model name for a provider from database settings."""
         try:
-            from app.models import Settings
-            defaults = {
-                'claude': 'claude-sonnet-4-5-20250929',
-                'gemini': 'gemini-2.5-flash-lite',
-                'grok': 'grok-4-fast-reasoning',
-                'perplexity': 'sonar'
-            }
-            return Settings.get(f'{provider}_model', defaults.get(provider, ''))
+            return self._get_setting(f'{provider}_model', self.DEFAULT_MODELS.get(provider, ''))
         except Exception as e:
             print(f"Error reading model name for {provider}: {e}")
             # Fallback to hardcoded defaults
-            return {
-                'claude': 'claude-sonnet-4-5-20250929',
-                'gemini': 'gemini-2.5-flash-lite',
-                'grok': 'grok-4-fast-reasoning',
-                'perplexity': 'sonar'
-            }.get(provider, '')
+            return self.DEFAULT_MODELS.get(provider, '')
 
     def generate_response(
         self,
@@ -150,46 +566,169 @@ Be professional, engaging, and help users derive meaningful insights."""
         Returns:
             Complete response string or iterator of response chunks
         """
-        # Load system prompt from file
-        system_prompt = self._load_system_prompt()
+        # Stable prefix: system prompt plus base context files (always loaded)
+        base_prompt = self._get_base_prompt()
 
-        # Always use hybrid mode: base context + semantic search
-        # Base context files are always loaded
-        context_files = self.get_context_files()
-        if context_files:
-            system_prompt += f"\n\nBase context:\n{context_files}"
-
-        # Semantic search context is provided by the caller
-        if context:
-            system_prompt += f"\n\nRelevant context from semantic search:\n{context}"
+        # Semantic search context is provided by the caller and changes per request,
+        # so it is kept separate from the cacheable prefix
+        context_suffix = f"\n\nRelevant context from semantic search:\n{context}" if context else ""
 
         # Use provided provider or fall back to env default
         if not provider:
             provider = os.getenv('LLM_PROVIDER', 'gemini').lower()
 
-        # Estimate token count (rough: chars / 4)
-        estimated_tokens = len(system_prompt) // 4
-        print(f"System prompt size: {len(system_prompt)} chars (~{estimated_tokens} tokens)")
+        # Estimate token count (rough: chars / 4) without joining the prompt parts
+        system_prompt_chars = len(base_prompt) + len(context_suffix)
+        estimated_tokens = system_prompt_chars // 4
+        print(f"System prompt size: {system_prompt_chars} chars (~{estimated_tokens} tokens)")
         print(f"Using LLM provider: {provider}")
 
-        # Route to appropriate provider
-        if provider == 'claude':
-            return self._generate_claude(messages, system_prompt, stream)
-        elif provider == 'gemini':
-            return self._generate_gemini(messages, system_prompt, stream)
-        elif provider == 'grok':
-            return self._generate_grok(messages, system_prompt, stream)
-        elif provider == 'perplexity':
-            return self._generate_perplexity(messages, system_prompt, stream)
-        else:
+        cache_key = None
+        if self._response_db is not None:
+            cache_key = hashlib.sha256(json.dumps(
+                [provider, self._get_model_name(provider), self._get_prompt_fingerprint(base_prompt), context_suffix, messages],
+                ensure_ascii=False
+            ).encode('utf-8')).digest()
+            cached = self._get_cached_response(cache_key)
+            if cached is not None:
+                print(f"Using cached {provider} response")
+                return (iter((cached,)), lambda: None) if stream else cached
+
+        if stream:
+            if self._coalesce_streams:
+                result = self._generate_coalesced_stream(provider, messages, base_prompt, context_suffix)
+            else:
+                result = self._route(provider, messages, base_prompt, context_suffix, stream=True)
+            if cache_key is not None and isinstance(result, tuple):
+                stream_iter, get_usage = result
+                result = (self._record_stream(cache_key, stream_iter), get_usage)
+            return result
+
+        response_text = self._route(provider, messages, base_prompt, context_suffix, stream)
+        if cache_key is not None and response_text and not self._is_error_response(response_text):
+            self._cache_response(cache_key, response_text)
+        return response_text
+
+    def _route(
+        self,
+        provider: str,
+        messages: list,
+        base_prompt: str,
+        context_suffix: str,
+        stream: bool,
+        max_tokens: int = DEFAULT_MAX_TOKENS
+    ):
+        """Send a request to the given provider."""
+        generate = self._providers.get(provider)
+        if generate is None:
             raise ValueError(f"Unknown LLM provider: {provider}")
+        if not stream:
+            with self._provider_slot(provider) as acquired:
+                if not acquired:
+                    return self._provider_busy_message(provider)
+                return generate(messages, base_prompt, stream, system_suffix=context_suffix, max_tokens=max_tokens)
+
+        result = generate(messages, base_prompt, stream, system_suffix=context_suffix, max_tokens=max_tokens)
+        if isinstance(result, tuple):
+            # Provider streams are lazy, so the slot is taken once the caller starts reading
+            stream, get_usage = result
+            return (self._slotted_stream(provider, stream), get_usage)
+        return result
+
+    @contextmanager
+    def _provider_slot(self, provider: str):
+        """Hold one of the provider's in-flight slots; yields False if none frees up in time."""
+        slot = self._provider_slots[provider]
+        start = time.perf_counter()
+        if not slot.acquire(timeout=self.PROVIDER_SLOT_TIMEOUT):
+            print(f"[WARNING] No free {provider} request slot after {self.PROVIDER_SLOT_TIMEOUT:.0f}s")
+            yield False
+            return
+        try:
+            wait = time.perf_counter() - start
+            if wait >= 1.0:
+                print(f"Waited {wait:.1f}s for a free {provider} request slot")
+            yield True
+        finally:
+            slot.release()
+
+    def _provider_busy_message(self, provider: str) -> str:
+        """Error text returned when every request slot for the provider stays taken."""
+        return f"Sorry, I encountered an error: {provider} is busy with other requests, please try again shortly."
+
+    def _slotted_stream(self, provider: str, stream: Iterator[str]) -> Iterator[str]:
+        """Relay a provider stream inside a request slot."""
+        try:
+            with self._provider_slot(provider) as acquired:
+                if not acquired:
+                    yield self._provider_busy_message(provider)
+                    return
+                yield from stream
+        finally:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+    def _generate_coalesced_stream(self, provider: str, messages: list, base_prompt: str, context_suffix: str):
+        """Stream a response, sharing one upstream call between identical concurrent requests.
+
+        Callers that arrive while an identical request (same provider, model,
+        prompt and messages) is still streaming replay its chunks instead of calling the
+        provider again. Every caller reports the shared call's token usage, so
+        each user's turn is still logged although the provider bills it once.
+        """
+        # The base prompt can be hundreds of KB, so it enters the key as its
+        # fingerprint rather than being re-serialized and hashed on every request
+        key = hashlib.sha256(
+            json.dumps(
+                [provider, self._get_model_name(provider), self._get_prompt_fingerprint(base_prompt),
+                 context_suffix, messages],
+                ensure_ascii=False
+            ).encode('utf-8')
+        ).digest()
+
+        with self._in_flight_lock:
+            shared = self._in_flight.get(key)
+        subscription = shared.subscribe() if shared is not None else None
+        if subscription is not None:
+            print(f"Joining identical in-flight {provider} request")
+            return (subscription, shared.get_usage)
+
+        result = self._route(provider, messages, base_prompt, context_suffix, stream=True)
+        if not isinstance(result, tuple):
+            # Error message or plain iterator; nothing to share
+            return result
+        stream, get_usage = result
+
+        with self._in_flight_lock:
+            shared = self._in_flight.get(key)
+            subscription = shared.subscribe() if shared is not None else None
+            if subscription is None:
+                shared = _SharedStream(stream, get_usage, on_done=lambda: self._finish_in_flight(key, shared))
+                self._in_flight[key] = shared
+                subscription = shared.subscribe()
+                shared.start()
+                return (subscription, shared.get_usage)
+
+        # An identical request registered while this one was being prepared;
+        # the upstream call has not started yet, so drop it and join that one
+        stream.close()
+        return (subscription, shared.get_usage)
+
+    def _finish_in_flight(self, key: bytes, shared: _SharedStream):
+        """Forget a finished or cancelled shared stream so later identical requests call the provider again."""
+        with self._in_flight_lock:
+            # A newer stream may already be registered under the same key
+            if self._in_flight.get(key) is shared:
+                del self._in_flight[key]
 
     def generate_simple_response(
         self,
         messages: list,
         model: str,
         system_prompt: str = "",
-        max_tokens: int = 2048
+        max_tokens: int = 2048,
+        use_cache: bool = False
     ) -> dict:
         """Generate a simple response from a specific model without context loading.
 
@@ -198,50 +737,146 @@ Be professional, engaging, and help users derive meaningful insights."""
             model: Model to use ('claude', 'gemini', 'grok', 'perplexity')
             system_prompt: Optional system prompt (defaults to empty string)
             max_tokens: Maximum tokens for response (defaults to 2048)
+            use_cache: Reuse a recent response to the identical request instead of
+                calling the model again (responses are sampled, so opt in only where
+                repeating an earlier answer is acceptable)
 
         Returns:
             Dict with 'content' key containing the response text
         """
-        try:
-            # Store the max_tokens temporarily
-            old_max_tokens = getattr(self, '_temp_max_tokens', None)
-            self._temp_max_tokens = max_tokens
+        cache_key = None
+        if use_cache:
+            cache_key = hashlib.sha256(json.dumps(
+                [model, self._get_model_name(model), system_prompt, max_tokens, messages],
+                ensure_ascii=False
+            ).encode('utf-8')).digest()
+            cached = self._get_cached_response(cache_key)
+            if cached is not None:
+                print(f"Using cached {model} response")
+                return {'content': cached}
 
+        try:
             # Route to appropriate provider
-            if model == 'claude':
-                response_text = self._generate_claude(messages, system_prompt, stream=False)
-            elif model == 'gemini':
-                response_text = self._generate_gemini(messages, system_prompt, stream=False)
-            elif model == 'grok':
-                response_text = self._generate_grok(messages, system_prompt, stream=False)
-            elif model == 'perplexity':
-                response_text = self._generate_perplexity(messages, system_prompt, stream=False)
-            else:
+            if model not in self._providers:
                 raise ValueError(f"Unknown model: {model}")
+            response_text = self._route(model, messages, system_prompt, "", stream=False, max_tokens=max_tokens)
 
-            # Restore old value
-            if old_max_tokens is None:
-                delattr(self, '_temp_max_tokens')
-            else:
-                self._temp_max_tokens = old_max_tokens
+            if cache_key is not None and response_text and not self._is_error_response(response_text):
+                self._cache_response(cache_key, response_text)
 
             return {'content': response_text}
         except Exception as e:
             print(f"Error in generate_simple_response for {model}: {str(e)}")
             return {'content': '', 'error': str(e)}
 
+    @classmethod
+    def _is_error_response(cls, response_text: str) -> bool:
+        """Check whether a provider returned an error message instead of an answer."""
+        return response_text.startswith(cls.ERROR_RESPONSE_PREFIXES) or response_text.endswith("API key not configured.")
+
+    def _open_response_db(self):
+        """Open the persistent response cache, or return None if it cannot be used."""
+        try:
+            os.makedirs(os.path.dirname(self.RESPONSE_CACHE_DB), exist_ok=True)
+            conn = sqlite3.connect(self.RESPONSE_CACHE_DB, check_same_thread=False)
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key BLOB PRIMARY KEY, response TEXT NOT NULL, used_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_used_at ON responses (used_at)')
+            conn.commit()
+            print(f"LLM response cache enabled at {self.RESPONSE_CACHE_DB}")
+            return conn
+        except sqlite3.Error as e:
+            print(f"Could not open LLM response cache: {e}")
+            return None
+
+    def _get_cached_response(self, key: bytes) -> Optional[str]:
+        """Return a cached response that has not expired, or None."""
+        with self._response_cache_lock:
+            entry = self._response_cache.get(key)
+            if entry is not None:
+                response_text, expires_at = entry
+                if expires_at >= time.monotonic():
+                    self._response_cache.move_to_end(key)
+                    return response_text
+                del self._response_cache[key]
+
+            if self._response_db is None:
+                return None
+            try:
+                row = self._response_db.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return None
+                self._response_db.execute('UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+                self._response_db.commit()
+            except sqlite3.Error as e:
+                print(f"LLM response cache read failed: {e}")
+                return None
+
+        self._cache_response(key, row[0], persist=False)
+        return row[0]
+
+    def _cache_response(self, key: bytes, response_text: str, persist: bool = True):
+        """Store a response in the LRU cache, evicting the oldest entries beyond its size."""
+        with self._response_cache_lock:
+            self._response_cache[key] = (response_text, time.monotonic() + self.RESPONSE_CACHE_TTL)
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+
+            if not persist or self._response_db is None:
+                return
+            try:
+                self._response_db.execute(
+                    'INSERT OR REPLACE INTO responses (key, response, used_at) VALUES (?, ?, ?)',
+                    (key, response_text, time.time())
+                )
+                self._response_db.execute(
+                    'DELETE FROM responses WHERE key NOT IN '
+                    '(SELECT key FROM responses ORDER BY used_at DESC LIMIT ?)',
+                    (self.RESPONSE_CACHE_DB_SIZE,)
+                )
+                self._response_db.commit()
+            except sqlite3.Error as e:
+                print(f"LLM response cache write failed: {e}")
+
+    def _record_stream(self, key: bytes, stream: Iterator[str]) -> Iterator[str]:
+        """Relay a response stream and cache the full text once it completes without error."""
+        parts = []
+        for chunk in stream:
+            parts.append(chunk)
+            yield chunk
+        if parts and not self._is_error_response(parts[0]) and not self._is_error_response(parts[-1]):
+            self._cache_response(key, "".join(parts))
+
+    def _get_anthropic_client(self):
+        """Return the shared Claude client, importing the SDK and creating it on first use."""
+        if self._anthropic is None:
+            with self._anthropic_lock:
+                if self._anthropic is None:
+                    import anthropic
+                    self._anthropic = anthropic.Anthropic(api_key=self.anthropic_key)
+        return self._anthropic
+
     def _generate_claude(
         self,
         messages: list,
         system_prompt: str,
-        stream: bool
+        stream: bool,
+        system_suffix: str = "",
+        max_tokens: int = DEFAULT_MAX_TOKENS
     ) -> str | Iterator[str]:
-        """Generate response using Claude API with prompt caching."""
+        """Generate response using Claude API with prompt caching.
+
+        The system prompt is sent as a cached block; system_suffix (per-request
+        search context) follows it uncached so it cannot invalidate the cache.
+        """
         if not self.anthropic_key:
             return "Claude API key not configured."
 
         try:
-            client = anthropic.Anthropic(api_key=self.anthropic_key)
+            client = self._get_anthropic_client()
 
             # Get configured model name
             model_name = self._get_model_name('claude')
@@ -249,29 +884,29 @@ Be professional, engaging, and help users derive meaningful insights."""
             # Use prompt caching by converting system prompt to list format
             # Mark the system prompt as cacheable to reduce costs
             # Only use cache_control if system prompt is not empty
+            system_blocks = []
             if system_prompt:
-                system_blocks = [
-                    {
+                cached_block = self._claude_system_block
+                if cached_block is None or cached_block["text"] is not system_prompt:
+                    cached_block = {
                         "type": "text",
                         "text": system_prompt,
-                        "cache_control": {"type": "ephemeral"}
+                        "cache_control": self.CLAUDE_CACHE_CONTROL
                     }
-                ]
-            else:
-                system_blocks = None
+                system_blocks.append(cached_block)
+            if system_suffix:
+                system_blocks.append({"type": "text", "text": system_suffix.lstrip()})
+            system_blocks = system_blocks or None
 
             if stream:
                 # Streaming response with caching
                 usage_data = {'captured': False}
 
                 def generate_stream():
-                    # Use temp max_tokens if set, otherwise default to 2048
-                    max_tokens_value = getattr(self, '_temp_max_tokens', 2048)
-
                     # Build kwargs, only include system if not None
                     stream_kwargs = {
                         'model': model_name,
-                        'max_tokens': max_tokens_value,
+                        'max_tokens': max_tokens,
                         'messages': messages
                     }
                     if system_blocks is not None:
@@ -299,13 +934,11 @@ Be professional, engaging, and help users derive meaningful insights."""
                 return (generate_stream(), get_usage)
             else:
                 # Non-streaming response with caching
-                # Use temp max_tokens if set, otherwise default to 2048
-                max_tokens_value = getattr(self, '_temp_max_tokens', 2048)
 
                 # Build kwargs, only include system if not None
                 create_kwargs = {
                     'model': model_name,
-                    'max_tokens': max_tokens_value,
+                    'max_tokens': max_tokens,
                     'messages': messages
                 }
                 if system_blocks is not None:
@@ -330,9 +963,12 @@ Be professional, engaging, and help users derive meaningful insights."""
         self,
         messages: list,
         system_prompt: str,
-        stream: bool
+        stream: bool,
+        system_suffix: str = "",
+        max_tokens: int = DEFAULT_MAX_TOKENS
     ) -> str | Iterator[str]:
         """Generate response using Google Gemini API."""
+        system_prompt += system_suffix
         if not self.gemini_key:
             return "Gemini API key not configured."
 
@@ -340,22 +976,18 @@ Be professional, engaging, and help users derive meaningful insights."""
             # Get configured model name
             model_name = self._get_model_name('gemini')
 
-            # Use Gemini model - only pass system_instruction if not empty
-            model_kwargs = {'model_name': model_name}
-            if system_prompt:
-                model_kwargs['system_instruction'] = system_prompt
-
-            model = genai.GenerativeModel(**model_kwargs)
+            model = self._get_gemini_model(model_name, system_prompt)
 
             # Convert messages to Gemini format
-            # Gemini expects alternating user/model messages
-            gemini_messages = []
-            for msg in messages:
-                role = "user" if msg['role'] == 'user' else "model"
-                gemini_messages.append({
-                    'role': role,
-                    'parts': [msg['content']]
-                })
+            # Gemini expects alternating user/model messages; content already given
+            # as a list of parts is passed through as-is
+            gemini_messages = [
+                {
+                    'role': self.GEMINI_ROLES.get(msg['role'], 'user'),
+                    'parts': msg['content'] if isinstance(msg['content'], list) else [msg['content']]
+                }
+                for msg in messages
+            ]
 
             if stream:
                 # Streaming response with usage tracking
@@ -373,28 +1005,31 @@ Be professional, engaging, and help users derive meaningful insights."""
                             gemini_messages,
                             stream=True,
                             generation_config=genai.types.GenerationConfig(
-                                max_output_tokens=2048,
+                                max_output_tokens=max_tokens,
                                 temperature=0.7,
                             )
                         )
 
                         has_content = False
+                        last_chunk = None
                         # Stream the text
                         for chunk in response:
+                            last_chunk = chunk
                             try:
-                                if chunk.text:
+                                text = chunk.text
+                                if text:
                                     has_content = True
-                                    yield chunk.text
+                                    yield text
                             except ValueError:
                                 # Empty chunk, skip
                                 pass
 
-                            # Try to capture usage from last chunk
-                            if hasattr(chunk, 'usage_metadata') and chunk.usage_metadata:
-                                usage = chunk.usage_metadata
-                                usage_data['input_tokens'] = getattr(usage, 'prompt_token_count', 0)
-                                usage_data['output_tokens'] = getattr(usage, 'candidates_token_count', 0)
-                                usage_data['captured'] = True
+                        # Capture usage once, from the last chunk, which carries the totals
+                        usage = getattr(last_chunk, 'usage_metadata', None)
+                        if usage:
+                            usage_data['input_tokens'] = getattr(usage, 'prompt_token_count', 0)
+                            usage_data['output_tokens'] = getattr(usage, 'candidates_token_count', 0)
+                            usage_data['captured'] = True
 
                         # If no content was yielded, show helpful message
                         if not has_content:
@@ -420,7 +1055,7 @@ Be professional, engaging, and help users derive meaningful insights."""
                 response = model.generate_content(
                     gemini_messages,
                     generation_config=genai.types.GenerationConfig(
-                        max_output_tokens=2048,
+                        max_output_tokens=max_tokens,
                         temperature=0.7,
                     )
                 )
@@ -448,318 +1083,144 @@ Be professional, engaging, and help users derive meaningful insights."""
                 return "⚠️ A Gemini modell nem tudott választ generálni. Ez lehet átmeneti hiba vagy quota limit. **Próbálj másik modellt választani a jobb felső sarokban lévő avatar menüből** (pl. Claude vagy Grok)."
             return f"Sorry, I encountered an error: {error_str}"
 
+    def _get_gemini_model(self, model_name: str, system_prompt: str):
+        """Return a GenerativeModel, reusing the last one while model and system prompt are unchanged."""
+        key = (model_name, system_prompt)
+        model, cached_key = self._gemini_model_cache
+        if model is not None and cached_key == key:
+            return model
+
+        # Use Gemini model - only pass system_instruction if not empty
+        model_kwargs = {'model_name': model_name}
+        if system_prompt:
+            model_kwargs['system_instruction'] = system_prompt
+
+        model = genai.GenerativeModel(**model_kwargs)
+        self._gemini_model_cache = (model, key)
+        return model
+
     def _generate_grok(
         self,
         messages: list,
         system_prompt: str,
-        stream: bool
+        stream: bool,
+        system_suffix: str = "",
+        max_tokens: int = DEFAULT_MAX_TOKENS
     ) -> str | Iterator[str]:
         """Generate response using Grok API (xAI)."""
-        print("=== GROK CALLED ===")
+        system_prompt += system_suffix
+        if self.debug_logging:
+            print("=== GROK CALLED ===")
 
-        if not self.grok_key:
-            error_msg = "Grok API key not configured."
-            print(f"ERROR: {error_msg}")
-            if stream:
-                def error_gen():
-                    yield error_msg
-                return error_gen()
-            return error_msg
-
-        try:
-            # Grok API endpoint (xAI) - uses OpenAI-compatible format
-            url = "https://api.x.ai/v1/chat/completions"
-
-            headers = {
-                "Authorization": f"Bearer {self.grok_key}",
-                "Content-Type": "application/json"
-            }
+        # System prompt first, then the conversation. Strings are already Unicode
+        # and the JSON encoder emits UTF-8, so contents are passed through as-is.
+        formatted_messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        formatted_messages += ({"role": msg["role"], "content": msg["content"]} for msg in messages)
 
-            # Prepare messages with UTF-8 encoding
-            formatted_messages = []
-
-            # Add system prompt
-            if system_prompt:
-                try:
-                    system_content = system_prompt.encode('utf-8', errors='ignore').decode('utf-8')
-                    formatted_messages.append({
-                        "role": "system",
-                        "content": system_content
-                    })
-                except Exception as e:
-                    print(f"Warning: Error encoding system prompt: {e}")
-                    formatted_messages.append({
-                        "role": "system",
-                        "content": system_prompt
-                    })
-
-            # Add conversation messages with UTF-8 encoding
-            for msg in messages:
-                try:
-                    content = msg["content"]
-                    if isinstance(content, str):
-                        content = content.encode('utf-8', errors='ignore').decode('utf-8')
-                    formatted_messages.append({
-                        "role": msg["role"],
-                        "content": content
-                    })
-                except Exception as e:
-                    print(f"Warning: Error encoding message: {e}")
-                    formatted_messages.append({
-                        "role": msg["role"],
-                        "content": str(msg["content"])
-                    })
-
-            # Get configured model name
-            model_name = self._get_model_name('grok')
-
-            data = {
-                "model": model_name,  # xAI's configured model
-                "messages": formatted_messages,
-                "stream": stream,
-                "temperature": 0.7
-            }
-
-            print(f"Grok API request - messages count: {len(formatted_messages)}, stream: {stream}")
-
-            if stream:
-                # Streaming response with usage tracking
-                usage_data = {
-                    'input_tokens': 0,
-                    'output_tokens': 0,
-                    'cache_creation_tokens': 0,
-                    'cache_read_tokens': 0,
-                    'captured': False
-                }
-
-                # Track output characters for fallback estimation
-                output_chars = 0
-
-                def generate_stream():
-                    nonlocal output_chars
-                    print("Starting Grok stream...")
-                    try:
-                        with httpx.stream("POST", url, headers=headers, json=data, timeout=120.0) as response:
-                            # Check status code first
-                            status = response.status_code
-                            print(f"Grok response status: {status}")
-
-                            if status != 200:
-                                # Read error response body
-                                error_body = ""
-                                for line in response.iter_lines():
-                                    error_body += line + "\n"
-                                print(f"Grok error body: {error_body}")
-                                yield f"\n\n[Error: HTTP {status} - {error_body}]"
-                                return
-
-                            # Read streaming response
-                            chunk_count = 0
-                            for line in response.iter_lines():
-                                if line.startswith("data: "):
-                                    chunk = line[6:]  # Remove "data: " prefix
-                                    if chunk.strip() and chunk != "[DONE]":
-                                        try:
-                                            chunk_data = json.loads(chunk)
-                                            chunk_count += 1
-
-                                            # Debug: Log chunk structure for first and last few chunks
-                                            if chunk_count <= 2 or chunk_count % 50 == 0:
-                                                print(f"Grok chunk #{chunk_count} keys: {list(chunk_data.keys())}")
-
-                                            if "choices" in chunk_data and len(chunk_data["choices"]) > 0:
-                                                delta = chunk_data["choices"][0].get("delta", {})
-                                                if "content" in delta:
-                                                    content = delta["content"]
-                                                    output_chars += len(content)
-                                                    yield content
-
-                                            # Capture usage from chunk (OpenAI format)
-                                            if "usage" in chunk_data:
-                                                usage = chunk_data["usage"]
-                                                usage_data['input_tokens'] = usage.get('prompt_tokens', 0)
-                                                usage_data['output_tokens'] = usage.get('completion_tokens', 0)
-                                                usage_data['captured'] = True
-                                                print(f"Grok usage captured from chunk #{chunk_count}")
-                                        except json.JSONDecodeError as e:
-                                            print(f"JSON decode error in streaming: {e}")
-                                            pass
-                                    elif chunk == "[DONE]":
-                                        print(f"Grok stream: Received [DONE] after {chunk_count} chunks")
-
-                            # If no usage captured from API, estimate from character count
-                            if not usage_data['captured'] and output_chars > 0:
-                                # Estimate tokens: ~1 token per 4 characters (rough approximation)
-                                estimated_output = max(1, output_chars // 4)
-
-                                # Estimate input tokens from message content
-                                input_chars = sum(len(msg['content']) for msg in formatted_messages)
-                                input_chars += len(system_prompt) if system_prompt else 0
-                                estimated_input = max(1, input_chars // 4)
-
-                                usage_data['input_tokens'] = estimated_input
-                                usage_data['output_tokens'] = estimated_output
-                                usage_data['captured'] = True
-                                print(f"Grok usage (estimated) - Input: {estimated_input} (~{input_chars} chars), Output: {estimated_output} (~{output_chars} chars)")
-                            elif usage_data['captured']:
-                                print(f"Grok usage - Input: {usage_data['input_tokens']}, Output: {usage_data['output_tokens']}")
-
-                            print("Grok stream completed")
-
-                    except httpx.ConnectError as e:
-                        error_msg = f"Connection error: {str(e)}"
-                        print(error_msg)
-                        yield f"\n\n[Error: {error_msg}]"
-                    except httpx.TimeoutException as e:
-                        error_msg = f"Request timeout: {str(e)}"
-                        print(error_msg)
-                        yield f"\n\n[Error: {error_msg}]"
-                    except Exception as e:
-                        print(f"Error in Grok streaming: {str(e)}")
-                        import traceback
-                        traceback.print_exc()
-                        yield f"\n\n[Error: {str(e)}]"
-
-                def get_usage():
-                    return usage_data if usage_data['captured'] else None
-
-                return (generate_stream(), get_usage)
-            else:
-                # Non-streaming response
-                print("Making non-streaming Grok request...")
-                response = httpx.post(url, headers=headers, json=data, timeout=120.0)
-                response.raise_for_status()
-                result = response.json()
-                print(f"Grok non-streaming response received")
-
-                # Log usage if available
-                if "usage" in result:
-                    usage = result["usage"]
-                    input_tokens = usage.get('prompt_tokens', 0)
-                    output_tokens = usage.get('completion_tokens', 0)
-                    print(f"Grok usage - Input: {input_tokens}, Output: {output_tokens}")
-
-                return result["choices"][0]["message"]["content"]
-
-        except httpx.HTTPStatusError as e:
-            error_msg = f"Grok API error {e.response.status_code}: {e.response.text}"
-            print(error_msg)
-            if stream:
-                def error_gen():
-                    yield f"Sorry, I encountered an error: {error_msg}"
-                return error_gen()
-            return f"Sorry, I encountered an error: {error_msg}"
-        except Exception as e:
-            print(f"Error calling Grok API: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            if stream:
-                def error_gen():
-                    yield f"Sorry, I encountered an error: {str(e)}"
-                return error_gen()
-            return f"Sorry, I encountered an error: {str(e)}"
+        return self._generate_openai_compatible('grok', self.grok_key, formatted_messages, stream, max_tokens=max_tokens)
 
     def _generate_perplexity(
         self,
         messages: list,
         system_prompt: str,
-        stream: bool
+        stream: bool,
+        system_suffix: str = "",
+        max_tokens: int = DEFAULT_MAX_TOKENS
     ) -> str | Iterator[str]:
         """Generate response using Perplexity API."""
-        print("=== PERPLEXITY CALLED ===")  # Debug
-
-        if not self.perplexity_key:
-            error_msg = "Perplexity API key not configured."
-            print(f"ERROR: {error_msg}")
-            if stream:
-                def error_gen():
-                    yield error_msg
-                return error_gen()
-            return error_msg
-
-        try:
-            url = "https://api.perplexity.ai/chat/completions"
-
-            headers = {
-                "Authorization": f"Bearer {self.perplexity_key}",
-                "Content-Type": "application/json"
-            }
-
-            # Prepare messages - Perplexity API format
-            # Perplexity requires messages without system role and strict alternation
+        system_prompt += system_suffix
+        # Prepare messages - Perplexity API format
+        # Perplexity requires messages without system role and strict alternation
+        if self.debug_logging:
+            print("=== PERPLEXITY CALLED ===")
             print(f"=== PERPLEXITY INPUT ===")
             print(f"Number of input messages: {len(messages)}")
             for i, msg in enumerate(messages):
                 print(f"  Input message {i}: role={msg['role']}")
             print(f"=== END INPUT ===")
 
-            formatted_messages = []
+        # Perplexity requires conversation to start with a user message
+        # Skip any leading assistant messages
+        start = 0
+        while start < len(messages) and messages[start]["role"] == "assistant":
+            start += 1
+        if self.debug_logging and start:
+            print(f"Removing {start} leading assistant message(s)")
+
+        # Ensure messages alternate between user and assistant by merging
+        # consecutive messages of the same role, joining each run once
+        cleaned_messages = []
+        merged_parts = []
+        prompt_pending = bool(system_prompt)
+        for msg in messages[start:]:
+            content = msg["content"]
+            if prompt_pending and msg["role"] == "user":
+                # Prepend the full system prompt (with context) to the first user message;
+                # Perplexity can combine this with its web search capabilities
+                content = system_prompt + "\n\n" + content
+                prompt_pending = False
+                if self.debug_logging:
+                    print(f"Added system prompt to first user message ({len(system_prompt)} chars)")
+            if cleaned_messages and cleaned_messages[-1]["role"] == msg["role"]:
+                merged_parts[-1].append(content)
+            else:
+                cleaned_messages.append({"role": msg["role"]})
+                merged_parts.append([content])
 
-            # Add actual conversation messages with UTF-8 encoding
-            for msg in messages:
-                try:
-                    # Ensure proper UTF-8 encoding for all content
-                    content = msg["content"]
-                    if isinstance(content, str):
-                        content = content.encode('utf-8', errors='ignore').decode('utf-8')
-                    formatted_messages.append({
-                        "role": msg["role"],
-                        "content": content
-                    })
-                except Exception as e:
-                    print(f"Warning: Error encoding message: {e}")
-                    formatted_messages.append({
-                        "role": msg["role"],
-                        "content": str(msg["content"])
-                    })
-
-            # Prepend system prompt (with context) to the first user message
-            if system_prompt and len(system_prompt) > 0 and len(formatted_messages) > 0:
-                # Find the first user message
-                for i, msg in enumerate(formatted_messages):
-                    if msg["role"] == "user":
-                        # Include the full system prompt with context
-                        # Perplexity can combine this with its web search capabilities
-                        formatted_messages[i]["content"] = system_prompt + "\n\n" + formatted_messages[i]["content"]
-                        print(f"Added system prompt to first user message ({len(system_prompt)} chars)")
-                        break
+        for cleaned, parts in zip(cleaned_messages, merged_parts):
+            cleaned["content"] = "\n\n".join(parts)
 
-            # Perplexity requires conversation to start with a user message
-            # Remove any leading assistant messages
-            while formatted_messages and formatted_messages[0]["role"] == "assistant":
-                print(f"Removing leading assistant message")
-                formatted_messages.pop(0)
-
-            # Ensure messages alternate between user and assistant
-            # Merge consecutive messages of the same role
-            cleaned_messages = []
-            for msg in formatted_messages:
-                if cleaned_messages and cleaned_messages[-1]["role"] == msg["role"]:
-                    # Merge with previous message
-                    cleaned_messages[-1]["content"] += "\n\n" + msg["content"]
-                else:
-                    cleaned_messages.append(msg)
-
-            formatted_messages = cleaned_messages
-
-            # Debug: Print message roles to verify alternation
+        formatted_messages = cleaned_messages
+
+        # Debug: Print message roles to verify alternation
+        if self.debug_logging:
             print(f"=== PERPLEXITY MESSAGE STRUCTURE ===")
             for i, msg in enumerate(formatted_messages):
                 print(f"  Message {i}: role={msg['role']}, content_length={len(msg['content'])}")
             print(f"=== END MESSAGE STRUCTURE ===")
 
-            # Get configured model name
-            model_name = self._get_model_name('perplexity')
+        return self._generate_openai_compatible(
+            'perplexity', self.perplexity_key, formatted_messages, stream, max_tokens=max_tokens
+        )
+
+    def _generate_openai_compatible(
+        self,
+        provider: str,
+        api_key: Optional[str],
+        formatted_messages: list,
+        stream: bool,
+        max_tokens: Optional[int] = None
+    ) -> str | Iterator[str]:
+        """Send already formatted messages to an OpenAI-compatible chat completions API.
+
+        Shared by Grok and Perplexity, which differ only in endpoint, request
+        options and how the messages are formatted. max_tokens is only sent when given.
+        """
+        name, url, options = self.OPENAI_COMPATIBLE_APIS[provider]
+
+        if not api_key:
+            error_msg = f"{name} API key not configured."
+            print(f"ERROR: {error_msg}")
+            if stream:
+                def error_gen():
+                    yield error_msg
+                return error_gen()
+            return error_msg
+
+        try:
+            headers = self._http_headers[provider]
 
             data = {
-                "model": model_name,  # Perplexity's configured model
+                "model": self._get_model_name(provider),
                 "messages": formatted_messages,
                 "stream": stream,
-                "max_tokens": 2048
+                **options
             }
+            if max_tokens is not None:
+                data["max_tokens"] = max_tokens
 
-            print(f"Perplexity API request - messages count: {len(formatted_messages)}, stream: {stream}")
-            print(f"Perplexity URL: {url}")
+            if self.debug_logging:
+                print(f"{name} API request - messages count: {len(formatted_messages)}, stream: {stream}")
 
             if stream:
                 # Streaming response with usage tracking
@@ -776,75 +1237,75 @@ Be professional, engaging, and help users derive meaningful insights."""
 
                 def generate_stream():
                     nonlocal output_chars
-                    print("Starting Perplexity stream...")
+                    if self.debug_logging:
+                        print(f"Starting {name} stream...")
                     try:
-                        with httpx.stream("POST", url, headers=headers, json=data, timeout=120.0) as response:
+                        with self._stream_request(provider, url, headers, data) as response:
                             # Check status code first, before accessing content
                             status = response.status_code
-                            print(f"Perplexity response status: {status}")
+                            if self.debug_logging:
+                                print(f"{name} response status: {status}")
 
                             if status != 200:
                                 # Read error response body
                                 error_body = ""
                                 for line in response.iter_lines():
                                     error_body += line + "\n"
-                                print(f"Perplexity error body: {error_body}")
+                                print(f"{name} error body: {error_body}")
                                 yield f"\n\n[Error: HTTP {status} - {error_body}]"
                                 return
 
-                            # Read streaming response line by line
+                            # Read streaming response; deltas that arrive in the same
+                            # network read are relayed as one chunk
                             chunk_count = 0
-                            for line in response.iter_lines():
-                                if line.startswith("data: "):
-                                    chunk = line[6:]
-                                    if chunk.strip() and chunk != "[DONE]":
-                                        try:
-                                            chunk_data = json.loads(chunk)
-                                            chunk_count += 1
-
-                                            # Debug: Log chunk structure for first and last few chunks
-                                            if chunk_count <= 2 or chunk_count % 50 == 0:
-                                                print(f"Perplexity chunk #{chunk_count} keys: {list(chunk_data.keys())}")
-
-                                            if "choices" in chunk_data and len(chunk_data["choices"]) > 0:
-                                                delta = chunk_data["choices"][0].get("delta", {})
-                                                if "content" in delta:
-                                                    content = delta["content"]
-                                                    output_chars += len(content)
-                                                    # Don't print content to avoid encoding issues
-                                                    yield content
-
-                                            # Capture usage from chunk (OpenAI format)
-                                            if "usage" in chunk_data:
-                                                usage = chunk_data["usage"]
-                                                usage_data['input_tokens'] = usage.get('prompt_tokens', 0)
-                                                usage_data['output_tokens'] = usage.get('completion_tokens', 0)
-                                                usage_data['captured'] = True
-                                                print(f"Perplexity usage captured from chunk #{chunk_count}")
-                                        except json.JSONDecodeError as e:
-                                            print(f"JSON decode error in streaming: {e}")
-                                            pass
-                                    elif chunk == "[DONE]":
-                                        print(f"Perplexity stream: Received [DONE] after {chunk_count} chunks")
+                            for payloads in self._iter_sse_batches(response):
+                                contents = []
+                                for payload in payloads:
+                                    try:
+                                        chunk_data = json.loads(payload)
+                                    except json.JSONDecodeError as e:
+                                        print(f"JSON decode error in streaming: {e}")
+                                        continue
+                                    chunk_count += 1
+
+                                    choices = chunk_data.get("choices")
+                                    if choices:
+                                        content = choices[0].get("delta", {}).get("content")
+                                        if content:
+                                            contents.append(content)
+
+                                    # Capture usage from chunk (OpenAI format)
+                                    if "usage" in chunk_data:
+                                        usage = chunk_data["usage"]
+                                        usage_data['input_tokens'] = usage.get('prompt_tokens', 0)
+                                        usage_data['output_tokens'] = usage.get('completion_tokens', 0)
+                                        usage_data['captured'] = True
+
+                                if contents:
+                                    content = contents[0] if len(contents) == 1 else "".join(contents)
+                                    output_chars += len(content)
+                                    yield content
 
                             # If no usage captured from API, estimate from character count
                             if not usage_data['captured'] and output_chars > 0:
                                 # Estimate tokens: ~1 token per 4 characters (rough approximation)
                                 estimated_output = max(1, output_chars // 4)
 
-                                # Estimate input tokens from message content
+                                # Estimate input tokens from message content, which already
+                                # includes the system prompt (as its own message or merged
+                                # into the first user turn)
                                 input_chars = sum(len(msg['content']) for msg in formatted_messages)
-                                input_chars += len(system_prompt) if system_prompt else 0
                                 estimated_input = max(1, input_chars // 4)
 
                                 usage_data['input_tokens'] = estimated_input
                                 usage_data['output_tokens'] = estimated_output
                                 usage_data['captured'] = True
-                                print(f"Perplexity usage (estimated) - Input: {estimated_input} (~{input_chars} chars), Output: {estimated_output} (~{output_chars} chars)")
+                                print(f"{name} usage (estimated) - Input: {estimated_input} (~{input_chars} chars), Output: {estimated_output} (~{output_chars} chars)")
                             elif usage_data['captured']:
-                                print(f"Perplexity usage - Input: {usage_data['input_tokens']}, Output: {usage_data['output_tokens']}")
+                                print(f"{name} usage - Input: {usage_data['input_tokens']}, Output: {usage_data['output_tokens']}")
 
-                            print("Perplexity stream completed")
+                            if self.debug_logging:
+                                print(f"{name} stream completed after {chunk_count} chunks")
 
                     except httpx.ConnectError as e:
                         error_msg = f"Connection error: {str(e)}"
@@ -855,7 +1316,7 @@ Be professional, engaging, and help users derive meaningful insights."""
                         print(error_msg)
                         yield f"\n\n[Error: {error_msg}]"
                     except Exception as e:
-                        print(f"Error in Perplexity streaming: {str(e)}")
+                        print(f"Error in {name} streaming: {str(e)}")
                         import traceback
                         traceback.print_exc()
                         yield f"\n\n[Error: {str(e)}]"
@@ -866,23 +1327,25 @@ Be professional, engaging, and help users derive meaningful insights."""
                 return (generate_stream(), get_usage)
             else:
                 # Non-streaming response
-                print("Making non-streaming Perplexity request...")
-                response = httpx.post(url, headers=headers, json=data, timeout=120.0)
+                if self.debug_logging:
+                    print(f"Making non-streaming {name} request...")
+                response = self._post_request(provider, url, headers, data)
                 response.raise_for_status()
                 result = response.json()
-                print(f"Perplexity non-streaming response received")
+                if self.debug_logging:
+                    print(f"{name} non-streaming response received")
 
                 # Log usage if available
                 if "usage" in result:
                     usage = result["usage"]
                     input_tokens = usage.get('prompt_tokens', 0)
                     output_tokens = usage.get('completion_tokens', 0)
-                    print(f"Perplexity usage - Input: {input_tokens}, Output: {output_tokens}")
+                    print(f"{name} usage - Input: {input_tokens}, Output: {output_tokens}")
 
                 return result["choices"][0]["message"]["content"]
 
         except httpx.HTTPStatusError as e:
-            error_msg = f"Perplexity API error {e.response.status_code}: {e.response.text}"
+            error_msg = f"{name} API error {e.response.status_code}: {e.response.text}"
             print(error_msg)
             if stream:
                 def error_gen():
@@ -890,7 +1353,7 @@ Be professional, engaging, and help users derive meaningful insights."""
                 return error_gen()
             return f"Sorry, I encountered an error: {error_msg}"
         except Exception as e:
-            print(f"Error calling Perplexity API: {str(e)}")
+            print(f"Error calling {name} API: {str(e)}")
             import traceback
             traceback.print_exc()
             if stream:
@@ -902,4 +1365,3 @@ Be professional, engaging, and help users derive meaningful insights."""
 
 # Singleton instance
 llm_service = LLMService()
-
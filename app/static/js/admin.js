@@ -2805,6 +2805,14 @@ async function loadEmbeddingStats() {
         if (vectorDocCount) vectorDocCount.textContent = stats.document_count || 0;
         if (vectorChunkCount) vectorChunkCount.textContent = stats.chunk_count || 0;
 
+        // Stored vectors were built for another provider, model, dimension or metric
+        const statusEl = document.getElementById('embeddings-status');
+        if (statusEl && stats.needs_reprocess) {
+            statusEl.textContent = 'Embeddings were built with outdated settings. Process embeddings again to rebuild them; search results may be inaccurate until then.';
+            statusEl.className = 'status-message error';
+            statusEl.style.display = 'block';
+        }
+
     } catch (error) {
         console.error('Error loading embedding stats:', error);
     }
@@ -0,0 +1,111 @@
+"""Tests for EmbeddingService collection handling."""
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("google.generativeai")
+
+from app.services.embedding_service import EmbeddingService
+
+
+class FakeCollection:
+    def __init__(self, name, metadata, count=1):
+        self.name = name
+        self.metadata = metadata
+        self._count = count
+
+    def count(self):
+        return self._count
+
+    def get(self, include=None):
+        return {'metadatas': [{'filename': 'a.txt'}] * self._count}
+
+
+class FakeClient:
+    """Mimics chromadb 0.4.22-0.5.x, where get_or_create rewrites stored metadata."""
+
+    def __init__(self):
+        self.collections = {}
+
+    def get_collection(self, name):
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.collections[name]
+
+    def get_or_create_collection(self, name, metadata=None):
+        collection = self.collections.setdefault(name, FakeCollection(name, metadata))
+        collection.metadata = metadata
+        return collection
+
+    def create_collection(self, name, metadata=None):
+        if name in self.collections:
+            raise ValueError(f"Collection {name} already exists.")
+        self.collections[name] = FakeCollection(name, metadata, count=0)
+        return self.collections[name]
+
+    def delete_collection(self, name):
+        del self.collections[name]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = EmbeddingService()
+    service.client = FakeClient()
+    monkeypatch.setattr(service, '_load_file_hashes', lambda: {'files': {'a.txt': 'hash'}})
+    return service
+
+
+def test_prepare_collection_reuses_matching_collection(service):
+    stored = FakeCollection(service.COLLECTION_NAME, service._collection_metadata())
+    service.client.collections[service.COLLECTION_NAME] = stored
+
+    previous, rebuilt = service._prepare_collection()
+
+    assert not rebuilt
+    assert previous == {'a.txt': 'hash'}
+    assert service.collection is stored
+
+
+@pytest.mark.parametrize('changes', [
+    {'embedding_dimensions': 256},
+    {'provider': 'openai'},
+    {'hnsw:space': 'l2'},
+])
+def test_prepare_collection_rebuilds_on_stored_metadata_mismatch(service, changes):
+    stored = FakeCollection(service.COLLECTION_NAME, {**service._collection_metadata(), **changes})
+    service.client.collections[service.COLLECTION_NAME] = stored
+
+    previous, rebuilt = service._prepare_collection()
+
+    assert rebuilt
+    assert previous == {}
+    assert service.collection is not stored
+    assert service.collection.metadata == service._collection_metadata()
+
+
+def test_prepare_collection_rebuilds_legacy_l2_collection(service):
+    # Collections created before the metric was recorded default to L2
+    legacy = {'description': service.COLLECTION_METADATA['description']}
+    stored = FakeCollection(service.COLLECTION_NAME, legacy)
+    service.client.collections[service.COLLECTION_NAME] = stored
+
+    _, rebuilt = service._prepare_collection()
+
+    assert rebuilt
+    assert service.collection.metadata['hnsw:space'] == 'ip'
+
+
+@pytest.mark.parametrize('space, needs_reprocess', [('ip', False), ('l2', True), (None, True)])
+def test_get_stats_flags_collections_that_need_reprocessing(service, monkeypatch, space, needs_reprocess):
+    metadata = service._collection_metadata()
+    if space is None:
+        del metadata['hnsw:space']
+    else:
+        metadata['hnsw:space'] = space
+    service.collection = FakeCollection(service.COLLECTION_NAME, metadata)
+    service.embeddings_initialized = True
+    monkeypatch.setattr(service, '_load_file_hashes', lambda: {})
+
+    stats = service.get_stats()
+
+    assert stats['chunk_count'] == 1
+    assert stats['needs_reprocess'] is needs_reprocess